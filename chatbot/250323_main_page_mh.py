@@ -1,14 +1,17 @@
-import io, os
+import hashlib, io, os, time
 from dotenv import load_dotenv
 from PIL import Image
 
 import streamlit as st
-import tensorflow as tf
-import google.generativeai as genai
 # import google import genai
 
 import image_model as im
 import assistant_mega as am
+import metrics
+import model_registry as mr
+import volume as vol
+import cine
+from chat_session import ChatSession
 
 
 
@@ -148,6 +151,118 @@ def create_medical_form():
     return st.session_state['form_data']
 
 
+## 지표
+@st.cache_resource
+def start_metrics_exporter():
+    # ESC_METRICS_PORT 지정 시 /metrics (Prometheus) 엔드포인트 실행 (프로세스당 1회)
+    if metrics.METRICS_PORT:
+        return metrics.start_metrics_server(metrics.METRICS_PORT)
+
+def render_debug_panel():
+    summary = metrics.REGISTRY.summary()
+    st.markdown('**단계별 지연 시간 (초)**')
+    st.dataframe([{'stage': stage, **stats} for stage, stats in summary['stages'].items()], hide_index=True)
+    st.markdown('**캐시 적중률**')
+    st.dataframe([{'cache': cache, **stats} for cache, stats in summary['caches'].items()], hide_index=True)
+
+
+## MRI 시리즈
+def render_volume_result(volume_files):
+    st.session_state['diagnosis_type'] = 1
+    volume_key = tuple((f.name, f.size) for f in volume_files)
+    if st.session_state.get('volume_key')!=volume_key: # 같은 시리즈는 재실행 시 다시 검출하지 않음
+        with st.spinner('MRI 시리즈 분석 중...'), metrics.timed('volume'):
+            try:
+                volume = vol.open_uploaded_volume(volume_files)
+            except Exception as e:
+                st.error(f'MRI 시리즈를 읽을 수 없습니다: {str(e)}')
+                return 0.0
+            try:
+                with mr.serving_model(1) as (model, _):
+                    st.session_state['volume_result'] = vol.detect_volume(volume, model)
+            except ValueError as e: # 모델 서버 백엔드 등
+                st.error(str(e))
+                return 0.0
+        st.session_state['volume_key'] = volume_key
+    result = st.session_state['volume_result']
+
+    col_image, col_result = st.columns([1, 2])
+    with col_image:
+        if result['best_detections'] is not None:
+            st.image(result['best_detections'].render(), caption=f"슬라이스 {result['best_slice']+1} / {result['total_slices']}", use_container_width=True)
+        with st.expander('슬라이스별 결과'):
+            st.dataframe([{k: v for k, v in s.items() if k!='boxes'} for s in result['slices']], hide_index=True)
+    with col_result:
+        with st.container(border=True):
+            st.subheader(f"{result['prob']}%의 확률로 {result['label']}입니다.")
+            if result['stopped_early']:
+                st.caption(f"뇌종양 슬라이스가 확인되어 {result['slices_processed']}장에서 분석을 멈췄습니다.")
+            generate_clicked = st.button('초진기록지 생성', key='generate_record')
+            medical_record, record_wait = am.request_medical_record(am.load_gemini(), st.session_state.form_data, 1,
+                result['prob'], vol.study_summary(result), st.session_state, force=generate_clicked, background=True)
+            render_medical_record(medical_record, 1, result['prob'], vol.study_summary(result))
+    return record_wait
+
+
+## 초음파 영상
+def render_cine_result(cine_file):
+    st.session_state['diagnosis_type'] = 0
+    cine_key = (cine_file.name, cine_file.size)
+    if st.session_state.get('cine_key')!=cine_key:
+        with st.spinner('초음파 영상 분석 중...'), metrics.timed('cine'):
+            try:
+                with mr.serving_model(0) as (model, _):
+                    st.session_state['cine_result'] = cine.predict_uploaded_clip(cine_file.getvalue(), model,
+                        suffix=os.path.splitext(cine_file.name)[1])
+            except ValueError as e: # 읽을 수 없는 영상, 모델 서버 백엔드 등
+                st.error(str(e))
+                return 0.0
+        st.session_state['cine_key'] = cine_key
+    result = st.session_state['cine_result']
+
+    col_image, col_result = st.columns([1, 2])
+    with col_image:
+        st.video(cine_file)
+        st.caption(f"분석 프레임 {result['frames_sampled']}장 중 {result['forward_passes']}장 추론 (중복 {result['forward_passes_saved']}장 생략)")
+        st.line_chart([f['probability'] for f in result['frames']])
+    with col_result:
+        with st.container(border=True):
+            st.subheader(f"{result['prob']}%의 확률로 {result['label']}입니다.")
+            generate_clicked = st.button('초진기록지 생성', key='generate_record')
+            medical_record, record_wait = am.request_medical_record(am.load_gemini(), st.session_state.form_data, 0,
+                result['prob'], result['label'], st.session_state, force=generate_clicked, background=True)
+            render_medical_record(medical_record, 0, result['prob'], result['label'])
+    return record_wait
+
+def render_medical_record(medical_record, diagnosis_type, prob, label):
+    if medical_record is None:
+        st.info('문진표 입력이 끝나면 초진기록지를 작성합니다.')
+        return
+    elif isinstance(medical_record, str): # 캐시된 기록지
+        st.write(medical_record)
+        record_text = medical_record
+    else: # 백그라운드 생성 중 (생성된 만큼 표시)
+        st.write(medical_record.text)
+        if not medical_record.done:
+            st.caption('초진기록지 작성 중...')
+            return
+        record_text = medical_record.text
+
+    # 완성된 기록지로 챗봇 대화 맥락 설정
+    st.session_state['chat_context'] = am.chat_context(st.session_state.form_data, diagnosis_type, prob, label, record_text)
+
+
+## 챗봇 세션
+def get_chat_session():
+    if 'chat_session' not in st.session_state:
+        st.session_state['chat_session'] = ChatSession(am.load_gemini())
+    chat_session = st.session_state['chat_session']
+    context = st.session_state.get('chat_context')
+    if context:
+        chat_session.seed(context, key=hash(context)) # 기록지가 바뀌면 맥락 재설정
+    return chat_session
+
+
 ## 메인
 def main():
     st.set_page_config(
@@ -157,8 +272,8 @@ def main():
     )
 
     init_session_state()
+    start_metrics_exporter()
     # model = im.load_model()
-    gemini = am.load_gemini()
 
     # 사이드바
     with st.sidebar:
@@ -170,6 +285,25 @@ def main():
             index=0  # 기본 선택값: '갑상선'
         )
         uploaded_file = st.file_uploader('**2) 이미지 업로드**', type=['jpg', 'bmp'])
+        volume_files, cine_file = None, None
+        if image_type=='갑상선 초음파': # 초음파 영상 클립
+            cine_file = st.file_uploader('**(선택) 초음파 영상 업로드**', type=['mp4', 'avi', 'mov'])
+        if image_type=='뇌 MRI': # 여러 슬라이스로 된 MRI 시리즈
+            volume_files = st.file_uploader('**(선택) MRI 시리즈 업로드** (DICOM 여러 장 또는 .npy)', type=['dcm', 'npy'], accept_multiple_files=True)
+
+        # 선택된 진단 종류의 모델을 업로드 전에 미리 로드
+        warmup_type = 0 if image_type=='갑상선 초음파' else 1
+        registry = mr.registry_for(warmup_type)
+        if registry is None:
+            im.start_warmup(warmup_type)
+        else: # 레지스트리의 active 버전을 백그라운드 로드
+            registry.reload_async(warmup_type)
+        with st.expander('로딩 시간'):
+            st.json({**im.startup_report(), 'gemini': am.LOAD_TIMES})
+        if registry is not None:
+            with st.expander('모델 버전'):
+                st.json(registry.status())
+        show_debug_panel = st.checkbox('디버그 패널', value=bool(os.getenv('ESC_DEBUG')))
 
     
     # 소개/설명
@@ -196,19 +330,32 @@ def main():
         medical_form_data = create_medical_form()
 
     # 이미지 업로드 시
-    if uploaded_file:
-        image = Image.open(uploaded_file)
+    record_wait = 0.0
+    if volume_files:
+        record_wait = render_volume_result(volume_files)
+    elif cine_file:
+        record_wait = render_cine_result(cine_file)
+    elif uploaded_file:
+        with metrics.timed('decode'):
+            try: # 큰 이미지는 작업 해상도로 축소 디코드
+                image = im.decode_image(uploaded_file.getvalue())
+            except ValueError as e:
+                st.error(str(e))
+                st.stop()
+            except OSError as e: # 잘리거나 손상된 파일
+                st.error(f'이미지를 읽을 수 없습니다: {str(e)}')
+                st.stop()
 
         # 모델 예측
         st.session_state['diagnosis_type'] = 0 if image_type=='갑상선 초음파' else 1
-        model = im.load_model(st.session_state.diagnosis_type)
+        with metrics.timed('predict'), mr.serving_model(st.session_state.diagnosis_type) as (model, model_version):
+            result = im.predict_image_cached(uploaded_file.getvalue(), model, st.session_state.diagnosis_type, image,
+                version=model_version) # 재실행 시 캐시 사용
         if st.session_state['diagnosis_type'] == 0:
-            prob, label = im.predict_image(image, model, st.session_state.diagnosis_type)
+            prob, label = result
         else:
-            prob, label, visualized_image = im.predict_image(image, model, st.session_state.diagnosis_type)
+            prob, label, visualized_image = result
 
-        # 초진기록지 초안
-        medical_record = am.generate_medical_record(gemini, st.session_state.form_data, st.session_state.diagnosis_type, prob, label)
 
         col_image, col_result = st.columns([1, 2])
         with col_image:
@@ -219,7 +366,15 @@ def main():
         with col_result:
             with st.container(border=True):
                 st.subheader(f'{prob}%의 확률로 {label}입니다.')
-                st.write(medical_record)
+                st.caption(f'모델 버전: {model_version}')
+                # 초진기록지 초안 (입력이 멈추거나 생성 버튼을 누를 때만 LLM 호출)
+                generate_clicked = st.button('초진기록지 생성', key='generate_record')
+                medical_record, record_wait = am.request_medical_record(am.load_gemini(), st.session_state.form_data, st.session_state.diagnosis_type,
+                    prob, label, st.session_state, force=generate_clicked, background=True,
+                    image_hash=hashlib.sha256(uploaded_file.getvalue()).hexdigest())
+                render_medical_record(medical_record, st.session_state.diagnosis_type, prob, label)
+    else:
+        am.cancel_record_job(st.session_state) # 업로드 취소 시 진행 중인 생성 중단
 
     
     ## 챗봇 ##
@@ -232,15 +387,29 @@ def main():
     # 채팅
     if prompt:=st.chat_input('메시지를 입력하세요.'):
         st.chat_message('user').markdown(prompt) # 사용자 메시지 출력
-        try: # gemini 응답
-            response = gemini.generate_content([prompt])
+        try: # gemini 응답 (기록지 + 최근 대화를 토큰 예산 안에서 함께 전송)
+            chat_session = get_chat_session()
             with st.chat_message('assistant'):
-                st.markdown(response.text) # gemini 답변 출력
+                response_text = st.write_stream(chat_session.stream(prompt)) # gemini 답변 스트리밍 출력
+                st.caption(f"입력 토큰 {chat_session.usage[-1]['input_tokens']} / {chat_session.budget}")
             st.session_state.messages.append({'role':'user', 'content':prompt}) # 대화 기록 저장
-            st.session_state.messages.append({'role':'assistant', 'content':response.text}) # 대화 기록 저장
+            st.session_state.messages.append({'role':'assistant', 'content':response_text}) # 대화 기록 저장
+        except ValueError as e: # 입력 토큰 한도를 넘는 질문
+            st.error(str(e))
         except Exception as e:
             st.error(f'Gemini 응답 오류 발생: {str(e)}')
 
+    # 단계별 지연 시간
+    if show_debug_panel:
+        with st.sidebar:
+            render_debug_panel()
+    metrics.REGISTRY.write_file()
+
+    # 디바운스 대기 / 백그라운드 생성 진행 상황 갱신 후 재실행 (그 사이 입력이 바뀌면 Streamlit이 새로 실행)
+    if record_wait>0:
+        time.sleep(record_wait)
+        st.rerun()
+
 
 if __name__=='__main__':
     main()
\ No newline at end of file
@@ -1,19 +1,43 @@
-import os
+import hashlib, importlib, os, threading, time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 
 import streamlit as st
-import google.generativeai as genai
 # import google import genai
 
+import metrics
+import store
+from llm_backend import FakeLLM, GeminiBackend
+from llm_client import LLMClient
+
+RECORD_CACHE_SIZE = 128 # 초진기록지 캐시 최대 개수
+RECORD_CACHE_TTL = 60 * 60 # 초 단위
+RECORD_DEBOUNCE_SECONDS = float(os.getenv('ESC_RECORD_DEBOUNCE', 2.0)) # 입력이 이 시간 동안 그대로면 생성
+RECORD_ERROR_PREFIX = '초진기록지 생성 중 오류가 발생했습니다'
+RECORD_WORKERS = int(os.getenv('ESC_RECORD_WORKERS', 4)) # 백그라운드 생성 스레드 수 (프로세스 공유)
+RECORD_POLL_SECONDS = 0.3 # 백그라운드 생성 중 화면 갱신 간격
+
+LOAD_TIMES = {} # Gemini 클라이언트 로딩 시간
+
 @st.cache_resource
 def load_gemini():
     load_dotenv()
+    if os.getenv('ESC_FAKE_LLM'): # 로컬 개발/테스트용 가짜 LLM
+        return LLMClient(FakeLLM())
+
+    start = time.perf_counter()
+    genai = importlib.import_module('google.generativeai') # 처음 필요할 때 import
+    LOAD_TIMES['import:google.generativeai'] = round(time.perf_counter()-start, 3)
     genai.configure(api_key=os.getenv('GOOGLE_API_KEY'))
     model = genai.GenerativeModel('gemini-1.5-pro')
 
-    return model
+    # 속도 제한/재시도/헤징을 프로세스 전체 세션이 공유 (ESC_LLM_SECONDARY_MODEL: 헤징용 예비 모델)
+    secondary_name = os.getenv('ESC_LLM_SECONDARY_MODEL')
+    secondary = GeminiBackend(genai.GenerativeModel(secondary_name), secondary_name) if secondary_name else None
+    return LLMClient(GeminiBackend(model), secondary)
 
-def generate_medical_record(llm_model, form_data, diagnosis_type, prob, diagnosis_result):
+def build_medical_prompt(form_data, diagnosis_type, prob, diagnosis_result):
     # 진단 종류
     diag_type = '갑상선 암' if diagnosis_type==0 else '뇌 종양'
     image_type = '초음파' if diagnosis_type==0 else 'MRI'
@@ -99,11 +123,176 @@ def generate_medical_record(llm_model, form_data, diagnosis_type, prob, diagnosi
     의학 전문용어를 적절히 사용하고, 간결하면서도 전문적인 문체로 작성해주세요.
     """
     
+    return prompt
+
+def generate_medical_record(llm_model, form_data, diagnosis_type, prob, diagnosis_result):
+    prompt = build_medical_prompt(form_data, diagnosis_type, prob, diagnosis_result)
+
     # Gemini로 초진기록지 생성
     try:
-        response = llm_model.generate_content(prompt)
-        medical_record = response.text
+        with metrics.timed('llm'):
+            medical_record = llm_model.generate(prompt)
     except Exception as e:
-        medical_record = f"초진기록지 생성 중 오류가 발생했습니다: {str(e)}"
+        medical_record = f"{RECORD_ERROR_PREFIX}: {str(e)}"
     
-    return medical_record
\ No newline at end of file
+    return medical_record
+
+## 초진기록지 캐시
+def record_fingerprint(form_data, diagnosis_type, prob, diagnosis_result):
+    # 프롬프트에 실제로 반영되는 값만 비교하도록 완성된 프롬프트를 해시
+    prompt = build_medical_prompt(form_data, diagnosis_type, prob, diagnosis_result)
+    return hashlib.sha256(prompt.encode('utf-8')).hexdigest()
+
+class RecordCache:
+    def __init__(self, max_entries=RECORD_CACHE_SIZE, ttl=RECORD_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict() # key -> (생성 시각, 기록지)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.monotonic()-entry[0]>self.ttl: # 만료
+                del self._entries[key]
+                entry = None
+            metrics.cache_event('record', entry is not None)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, record):
+        with self._lock:
+            self._entries[key] = (time.monotonic(), record)
+            self._entries.move_to_end(key)
+            while len(self._entries)>self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'hits': self.hits, 'misses': self.misses}
+
+@st.cache_resource
+def load_record_cache():
+    return RecordCache()
+
+## 백그라운드 생성
+class RecordJob:
+    def __init__(self, key):
+        self.key = key
+        self.chunks = []
+        self.done = False
+        self._cancelled = threading.Event()
+
+    @property
+    def text(self):
+        return ''.join(self.chunks)
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def cancel(self):
+        self._cancelled.set()
+
+def _run_record_job(job, llm_model, prompt, on_complete=None):
+    # 초진기록지 스트리밍 생성 (조각이 도착하는 대로 job.chunks에 누적)
+    start = time.perf_counter()
+    try:
+        for chunk in llm_model.stream(prompt):
+            if job.cancelled: # 입력이 바뀌면 남은 응답은 버림
+                return
+            if not job.chunks:
+                metrics.observe('llm_first_chunk', time.perf_counter()-start)
+            job.chunks.append(chunk)
+        if not job.cancelled:
+            metrics.observe('llm', time.perf_counter()-start)
+            if on_complete is not None:
+                on_complete(job.text)
+    except Exception as e:
+        metrics.REGISTRY.error('llm')
+        job.chunks.append(f"\n\n{RECORD_ERROR_PREFIX}: {str(e)}")
+    finally:
+        job.done = True
+
+@st.cache_resource
+def load_record_executor():
+    return ThreadPoolExecutor(RECORD_WORKERS, thread_name_prefix='record')
+
+def cancel_record_job(state):
+    job = state.get('record_job')
+    if job is not None and not job.done:
+        job.cancel()
+    state['record_job'] = None
+
+def request_medical_record(llm_model, form_data, diagnosis_type, prob, diagnosis_result, state,
+                           force=False, debounce=RECORD_DEBOUNCE_SECONDS, cache=None, background=False,
+                           image_hash=None, result_store=None):
+    # 반환값: (기록지, 대기 시간). 기록지가 None이면 대기 시간 후 다시 호출
+    # background=True면 RecordJob을 반환하고 대기 시간 후 다시 호출 (job.text에 생성된 만큼 누적)
+    cache = cache if cache is not None else load_record_cache()
+    key = record_fingerprint(form_data, diagnosis_type, prob, diagnosis_result)
+    job = state.get('record_job')
+    if job is not None and (job.key!=key or (force and job.done)): # 업로드/문진표가 바뀌면 진행 중인 생성 취소, 완료 후 생성 버튼은 재시도
+        cancel_record_job(state)
+        job = None
+    if job is not None:
+        return job, (0.0 if job.done else RECORD_POLL_SECONDS)
+
+    record = cache.get(key)
+    if record is not None:
+        return record, 0.0
+
+    # 다른 세션/재시작 전에 생성된 기록지
+    result_store = result_store if result_store is not None else store.load_store()
+    if result_store is not None:
+        record = result_store.get_record(key)
+        metrics.cache_event('record_store', record is not None)
+        if record is not None:
+            cache.put(key, record)
+            return record, 0.0
+
+    # 디바운스: 입력이 바뀌면 타이머 재시작
+    now = time.monotonic()
+    if state.get('record_key')!=key:
+        state['record_key'] = key
+        state['record_since'] = now
+    wait = debounce - (now-state['record_since'])
+    if not force and wait>0:
+        return None, wait
+
+    def save(text): # 완료된 기록지만 저장 (오류/취소는 저장하지 않음)
+        cache.put(key, text)
+        if result_store is not None:
+            result_store.put_record(key, diagnosis_type, text, image_hash)
+
+    if background:
+        job = RecordJob(key)
+        state['record_job'] = job
+        prompt = build_medical_prompt(form_data, diagnosis_type, prob, diagnosis_result)
+        load_record_executor().submit(_run_record_job, job, llm_model, prompt, save)
+        return job, RECORD_POLL_SECONDS
+
+    record = generate_medical_record(llm_model, form_data, diagnosis_type, prob, diagnosis_result)
+    if not record.startswith(RECORD_ERROR_PREFIX): # 오류는 캐시하지 않음
+        save(record)
+    return record, 0.0
+
+## 챗봇 맥락
+def patient_summary(form_data, diagnosis_type, prob, diagnosis_result):
+    diag_type = '갑상선 암' if diagnosis_type==0 else '뇌 종양'
+    conditions_self = form_data.get('conditions_self', [])
+    conditions_family = form_data.get('conditions_family', [])
+    return (f"{form_data.get('gender', '정보 없음')}/{form_data.get('age', '정보 없음')}세, "
+        f"{form_data.get('height', '정보 없음')}cm/{form_data.get('weight', '정보 없음')}kg. "
+        f"과거병력: {', '.join(conditions_self) if conditions_self else '특이사항 없음'}. "
+        f"가족력: {', '.join(conditions_family) if conditions_family else '특이사항 없음'}. "
+        f"{diag_type} AI 진단: {diagnosis_result} (신뢰도 {prob}%)")
+
+def chat_context(form_data, diagnosis_type, prob, diagnosis_result, medical_record):
+    return f"{patient_summary(form_data, diagnosis_type, prob, diagnosis_result)}\n\n{medical_record}"
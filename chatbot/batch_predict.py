@@ -0,0 +1,160 @@
+import argparse, csv, hashlib, json, os, sys, time
+
+
+import image_model as im
+import store
+from preprocess_pool import PreprocessPipeline
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.bmp', '.png')
+
+
+## 입력 수집
+def collect_image_paths(inputs):
+    # 디렉터리(하위 폴더 포함) 또는 파일 목록 -> 이미지 경로 목록
+    paths = []
+    for item in inputs:
+        if os.path.isdir(item):
+            for root, _, files in os.walk(item):
+                for name in sorted(files):
+                    if name.lower().endswith(IMAGE_EXTENSIONS):
+                        paths.append(os.path.join(root, name))
+        else:
+            paths.append(item)
+    return paths
+
+def iter_batches(paths, batch_size):
+    # 이미지를 한 번에 모두 읽지 않고 배치 단위로 읽기
+    batch_paths, batch_images = [], []
+    for path in paths:
+        try:
+            image = im.decode_image(path)
+        except Exception as e:
+            print(f'Error reading {path}: {e}', file=sys.stderr)
+            continue
+        batch_paths.append(path)
+        batch_images.append(image)
+        if len(batch_images)==batch_size:
+            yield batch_paths, batch_images
+            batch_paths, batch_images = [], []
+    if batch_images:
+        yield batch_paths, batch_images
+
+
+## 결과 저장
+class ResultWriter:
+    def __init__(self, output_path):
+        self.output_path = output_path
+        self.is_csv = output_path.lower().endswith('.csv')
+        self._file = open(output_path, 'w', encoding='utf-8', newline='')
+        if self.is_csv:
+            self._writer = csv.DictWriter(self._file, fieldnames=['path', 'prob', 'label', 'boxes'])
+            self._writer.writeheader()
+
+    def write(self, row):
+        if self.is_csv:
+            self._writer.writerow({**row, 'boxes': json.dumps(row['boxes'])})
+        else:
+            self._file.write(json.dumps(row, ensure_ascii=False) + '\n')
+
+    def close(self):
+        self._file.close()
+
+
+## 배치 추론
+def iter_preprocessed_batches(paths, diagnosis_type, batch_size):
+    for batch_paths, batch_images in iter_batches(paths, batch_size):
+        yield batch_paths, [im.preprocess_for_model(image, diagnosis_type) for image in batch_images]
+
+def iter_cascade_outputs(paths, model, batch_size):
+    # 뇌 MRI 선별 단계: 선별 모델은 원본 이미지가 필요하므로 전처리 풀 대신 원본 배치로 처리
+    for batch_paths, batch_images in iter_batches(paths, batch_size):
+        results = im.predict_image_batch(batch_images, model, 1, render=False)
+        yield batch_paths, [{'prob': float(prob), 'label': label, 'boxes': detections.to_boxes()}
+            for prob, label, detections in results]
+
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def run_batch(inputs, diagnosis_type, output_path, batch_size=16, model=None,
+              workers=0, queue_size=64, ordered=True, result_store=None):
+    paths = collect_image_paths(inputs)
+    result_store = result_store if result_store is not None else store.load_store()
+    version = im.model_version(diagnosis_type)
+
+    # 저장소에 이미 있는 결과는 바로 기록하고 나머지만 추론
+    writer = ResultWriter(output_path)
+    hashes, pending = {}, []
+    for path in paths:
+        if result_store is None:
+            pending.append(path)
+            continue
+        try:
+            hashes[path] = file_hash(path)
+        except OSError as e:
+            print(f'Error reading {path}: {e}', file=sys.stderr)
+            continue
+        stored = result_store.get_prediction(hashes[path], diagnosis_type, version)
+        if stored is None:
+            pending.append(path)
+        else:
+            writer.write({'path': path, 'prob': stored['prob'], 'label': stored['label'], 'boxes': stored['boxes']})
+    stored_count = len(paths)-len(pending)
+    paths = pending
+    if paths and model is None:
+        model = im.load_model(diagnosis_type)
+
+    cascade = diagnosis_type==1 and im.CASCADE_ENABLED # predict_image와 같은 선별 단계 (저장소 버전 태그와 일치)
+    if cascade:
+        if workers>0:
+            print('ESC_CASCADE: preprocessing runs in the main process (--workers ignored)', file=sys.stderr)
+        batches = iter_cascade_outputs(paths, model, batch_size)
+    elif workers>0: # 전처리를 프로세스 풀에서 병렬로 수행
+        pipeline = PreprocessPipeline(diagnosis_type, workers=workers, queue_size=queue_size,
+            batch_size=batch_size, ordered=ordered)
+        batches = pipeline.batches(paths)
+    else:
+        batches = iter_preprocessed_batches(paths, diagnosis_type, batch_size)
+
+    count = 0
+    start = time.perf_counter()
+    try:
+        for batch_paths, batch in batches:
+            outputs = batch if cascade else im.predict_preprocessed(batch, model, diagnosis_type)
+            for path, output in zip(batch_paths, outputs):
+                writer.write({'path': path, **output})
+                if result_store is not None: # 시각화 이미지 없이 결과/박스만 저장
+                    result_store.put_prediction(hashes[path], diagnosis_type, version, output['prob'], output['label'],
+                        output['boxes'], has_overlay=False)
+            count += len(batch_paths)
+            elapsed = time.perf_counter()-start
+            print(f'{count}/{len(paths)} images, {count/elapsed:.2f} images/sec', file=sys.stderr)
+    finally:
+        writer.close()
+        if result_store is not None:
+            result_store.flush()
+
+    elapsed = time.perf_counter()-start
+    return {'images': count, 'stored': stored_count, 'seconds': round(elapsed, 3),
+        'images_per_sec': round(count/elapsed, 2) if elapsed>0 else 0.0}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='폴더/파일 목록 일괄 진단')
+    parser.add_argument('inputs', nargs='+', help='이미지 파일 또는 디렉터리')
+    parser.add_argument('--type', type=int, choices=[0, 1], required=True, help='0: 갑상선 초음파, 1: 뇌 MRI')
+    parser.add_argument('--output', required=True, help='결과 파일 (.csv 또는 .jsonl)')
+    parser.add_argument('--batch-size', type=int, default=16)
+    parser.add_argument('--workers', type=int, default=0, help='전처리 프로세스 수 (0: 메인 프로세스에서 처리)')
+    parser.add_argument('--queue-size', type=int, default=64, help='동시에 전처리 중인 최대 이미지 수')
+    parser.add_argument('--unordered', action='store_true', help='완료 순서대로 결과 기록')
+    args = parser.parse_args(argv)
+
+    summary = run_batch(args.inputs, args.type, args.output, batch_size=args.batch_size,
+        workers=args.workers, queue_size=args.queue_size, ordered=not args.unordered)
+    print(json.dumps(summary))
+
+if __name__=='__main__':
+    main()
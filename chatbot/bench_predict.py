@@ -0,0 +1,47 @@
+import argparse, json, time
+
+import numpy as np
+
+import image_model as im
+
+BATCH_SIZES = (1, 8, 32)
+
+
+## model.predict vs tf.function 호출 지연 시간
+def _measure(fn, inputs, repeats, warmup=3):
+    for _ in range(warmup):
+        fn(inputs)
+    latencies = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn(inputs)
+        latencies.append(time.perf_counter()-start)
+    return {'p50_ms': round(float(np.percentile(latencies, 50))*1000, 2), 'mean_ms': round(float(np.mean(latencies))*1000, 2)}
+
+def run(batch_sizes=BATCH_SIZES, repeats=20):
+    compiled = im.load_model(0, backend='native')
+    keras_model = compiled.model
+    rng = np.random.default_rng(0)
+
+    report = {}
+    for batch_size in batch_sizes:
+        inputs = rng.uniform(0, 255, (batch_size, 180, 180, 3)).astype(np.float32)
+        before = _measure(lambda x: keras_model.predict(x, verbose=0), inputs, repeats)
+        after = _measure(compiled.predict, inputs, repeats)
+        report[batch_size] = {
+            'model.predict': before,
+            'tf.function': after,
+            'speedup': round(before['p50_ms']/after['p50_ms'], 2),
+        }
+    return report
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='갑상선 분류 모델 호출 지연 시간 비교')
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=list(BATCH_SIZES))
+    parser.add_argument('--repeats', type=int, default=20)
+    args = parser.parse_args(argv)
+
+    print(json.dumps(run(args.batch_sizes, args.repeats), indent=2))
+
+if __name__=='__main__':
+    main()
@@ -0,0 +1,121 @@
+import argparse, json, os, platform, subprocess, sys, time
+
+import numpy as np
+
+import image_model as im
+import assistant_mega as am
+from llm_backend import FakeLLM
+from stub_models import load_stub_model, synthetic_image
+
+SIZES = ((256, 256), (512, 512), (1024, 768), (2048, 1536))
+SAMPLE_FORM = {
+    'gender': '남', 'age': 40, 'height': 180.0, 'weight': 80.0,
+    'conditions_self': ['고혈압'], 'conditions_family': [],
+    'smoking': {'status': '안 함', 'details': {}},
+    'drinking': {'status': '안 함', 'details': {}},
+    'exercise': {'status': '안 함', 'details': {}},
+}
+
+
+## 측정
+def measure(fn, repeats, warmup=2):
+    for _ in range(warmup):
+        fn()
+    latencies = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        latencies.append(time.perf_counter()-start)
+    p50, p95 = np.percentile(latencies, [50, 95])
+    return {'repeats': repeats, 'p50_ms': round(float(p50)*1000, 3), 'p95_ms': round(float(p95)*1000, 3),
+        'mean_ms': round(float(np.mean(latencies))*1000, 3)}
+
+def load_benchmark_model(diagnosis_type, stub=False):
+    # 가중치 파일이 없으면 대체 모델 사용
+    path = im.classifier_path() if diagnosis_type==0 else im.YOLO_PATH
+    if stub or not os.path.exists(path):
+        return load_stub_model(diagnosis_type), 'stub'
+    return im.load_model(diagnosis_type), 'real'
+
+def run(sizes=SIZES, repeats=20, stub=False, llm_delay=0.0):
+    results = []
+    models = {}
+    for diagnosis_type in (0, 1):
+        models[diagnosis_type] = load_benchmark_model(diagnosis_type, stub)
+
+    for width, height in sizes:
+        size = f'{width}x{height}'
+        ultrasound = synthetic_image(0, (width, height), seed=width)
+        mri = synthetic_image(1, (width, height), seed=height)
+
+        cases = {
+            'preprocess_image': lambda: im.preprocess_image(ultrasound),
+            'image_to_tensor': lambda: im.image_to_tensor(ultrasound),
+            'preprocess_image_for_yolo': lambda: im.preprocess_image_for_yolo(mri),
+            'predict_image[0]': lambda: im.predict_image(ultrasound, models[0][0], 0),
+            'predict_image[1]': lambda: im.predict_image(mri, models[1][0], 1),
+        }
+        for name, fn in cases.items():
+            results.append({'name': name, 'size': size, **measure(fn, repeats)})
+
+    # 초진기록지 생성 (가짜 LLM, 지연 없음 = 프롬프트 구성 + 호출 오버헤드)
+    llm = FakeLLM(delay=llm_delay, first_delay=llm_delay)
+    results.append({'name': 'generate_medical_record', 'size': '-',
+        **measure(lambda: am.generate_medical_record(llm, SAMPLE_FORM, 0, 87.5, '갑상선 암'), repeats)})
+
+    return {'env': environment(models), 'results': results}
+
+def environment(models):
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = None
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'commit': commit,
+        'models': {str(k): kind for k, (_, kind) in models.items()},
+        'backend': im.MODEL_BACKEND,
+        # 대체 모델은 NumPy 입력만 쓰므로 --stub 실행에서 TensorFlow가 로드됐다면 전처리 경로 회귀
+        'tensorflow_imported': 'tensorflow' in sys.modules,
+    }
+
+
+## 비교
+def compare(current, baseline):
+    # 같은 (name, size) 항목의 p50 비율 (>1이면 느려짐)
+    previous = {(r['name'], r['size']): r for r in baseline['results']}
+    rows = []
+    for result in current['results']:
+        before = previous.get((result['name'], result['size']))
+        if before and before['p50_ms']>0:
+            rows.append({'name': result['name'], 'size': result['size'], 'before_ms': before['p50_ms'],
+                'after_ms': result['p50_ms'], 'ratio': round(result['p50_ms']/before['p50_ms'], 3)})
+    return rows
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='전처리/추론/기록지 생성 오프라인 벤치마크')
+    parser.add_argument('--output', help='결과 JSON 파일')
+    parser.add_argument('--compare', help='비교할 이전 결과 JSON 파일')
+    parser.add_argument('--repeats', type=int, default=20)
+    parser.add_argument('--stub', action='store_true', help='가중치가 있어도 대체 모델 사용')
+    parser.add_argument('--sizes', nargs='+', help='예: 512x512 1024x768')
+    args = parser.parse_args(argv)
+
+    sizes = [tuple(int(v) for v in size.split('x')) for size in args.sizes] if args.sizes else SIZES
+    report = run(sizes, args.repeats, args.stub)
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text)
+    else:
+        print(text)
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)
+        print(json.dumps(compare(report, baseline), ensure_ascii=False, indent=2))
+
+if __name__=='__main__':
+    main()
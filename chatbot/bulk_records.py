@@ -0,0 +1,169 @@
+import argparse, asyncio, csv, json, os, sys, time
+
+import assistant_mega as am
+import image_model as im
+import metrics
+import store
+from llm_client import LLMClient
+
+RECORD_FIELDS = ('id', 'diagnosis_type', 'prob', 'label', 'form_data')
+
+
+## 입력 읽기
+def _parse_value(value):
+    # CSV 값은 모두 문자열이므로 숫자/목록/객체는 JSON으로 해석 (키, 몸무게 등)
+    try:
+        return json.loads(value)
+    except (TypeError, json.JSONDecodeError):
+        return value
+
+def parse_row(raw):
+    # CSV는 form_data를 JSON 문자열로 받고, form_data 열이 없으면 나머지 열을 form_data로 사용
+    form_data = raw.get('form_data')
+    if form_data is None:
+        form_data = {k: _parse_value(v) for k, v in raw.items() if k not in RECORD_FIELDS}
+    elif isinstance(form_data, str):
+        form_data = json.loads(form_data) if form_data else {}
+    return {'id': raw.get('id'), 'form_data': form_data, 'diagnosis_type': int(raw['diagnosis_type']),
+        'prob': float(raw['prob']), 'label': raw['label']}
+
+def iter_rows(path):
+    with open(path, encoding='utf-8', newline='') as f:
+        if path.lower().endswith('.csv'):
+            for raw in csv.DictReader(f):
+                yield parse_row(raw)
+        else:
+            for line in f:
+                if line.strip():
+                    yield parse_row(json.loads(line))
+
+
+## 체크포인트
+def load_checkpoint(output_path):
+    # 출력 파일이 곧 체크포인트: 오류 없이 끝난 행의 fingerprint는 다시 생성하지 않음
+    done = set()
+    if not os.path.exists(output_path):
+        return done
+    with open(output_path, encoding='utf-8') as f:
+        for line in f:
+            try:
+                row = json.loads(line)
+            except json.JSONDecodeError: # 중단 시점에 잘린 마지막 줄
+                continue
+            if not row.get('error'):
+                done.add(row['fingerprint'])
+    return done
+
+def _truncate_partial_line(output_path):
+    # 중단으로 줄바꿈 없이 끝난 마지막 줄은 버리고 이어서 기록
+    if not os.path.exists(output_path):
+        return
+    with open(output_path, 'rb+') as f:
+        data = f.read()
+        if data and not data.endswith(b'\n'):
+            f.truncate(data.rfind(b'\n')+1)
+
+
+## 일괄 생성
+async def _generate_row(client, row, fingerprint, result_store):
+    prompt = am.build_medical_prompt(row['form_data'], row['diagnosis_type'], row['prob'], row['label'])
+    record = result_store.get_record(fingerprint) if result_store is not None else None
+    if record is not None:
+        return {'record': record, 'stored': True}
+    try:
+        with metrics.timed('llm'):
+            record = await client.agenerate(prompt)
+    except Exception as e:
+        metrics.REGISTRY.error('llm')
+        return {'error': str(e)}
+    if result_store is not None:
+        result_store.put_record(fingerprint, row['diagnosis_type'], record)
+    return {'record': record}
+
+def _selected(row, positives_only, min_prob):
+    # prob는 라벨의 신뢰도 (정상 행은 (1-p)*100)이므로 min_prob는 양성 행에만 적용
+    if row['label'] not in im.POSITIVE_LABELS:
+        return not positives_only
+    return row['prob']>=min_prob
+
+async def _run(rows, client, output_path, concurrency, min_prob, result_store, positives_only=False):
+    done = load_checkpoint(output_path)
+    _truncate_partial_line(output_path)
+    semaphore = asyncio.Semaphore(concurrency)
+    summary = {'rows': 0, 'skipped': 0, 'generated': 0, 'stored': 0, 'errors': 0}
+    start = time.perf_counter()
+
+    with open(output_path, 'a', encoding='utf-8') as out:
+        async def work(row, fingerprint):
+            try:
+                result = await _generate_row(client, row, fingerprint, result_store)
+            finally:
+                semaphore.release()
+            # 완료 순서대로 한 줄씩 바로 기록 (중단돼도 끝난 행은 남음)
+            out.write(json.dumps({'id': row['id'], 'fingerprint': fingerprint, 'diagnosis_type': row['diagnosis_type'],
+                'prob': row['prob'], 'label': row['label'], **result}, ensure_ascii=False) + '\n')
+            out.flush()
+            key = 'errors' if 'error' in result else 'stored' if result.get('stored') else 'generated'
+            summary[key] += 1
+            finished = summary['generated']+summary['stored']+summary['errors']
+            if finished % 10==0:
+                elapsed = time.perf_counter()-start
+                print(f'{finished} records, {finished/elapsed:.2f} records/sec', file=sys.stderr)
+
+        tasks = []
+        for row in rows:
+            summary['rows'] += 1
+            try:
+                fingerprint = am.record_fingerprint(row['form_data'], row['diagnosis_type'], row['prob'], row['label'])
+            except Exception as e: # 필수 값(키, 몸무게 등)이 빠졌거나 형식이 잘못된 행
+                print(f'Error building prompt for row {row["id"]}: {e}', file=sys.stderr)
+                summary['errors'] += 1
+                continue
+            if fingerprint in done or not _selected(row, positives_only, min_prob):
+                summary['skipped'] += 1
+                continue
+            done.add(fingerprint) # 같은 프롬프트가 여러 행에 있으면 한 번만 생성
+            await semaphore.acquire() # 입력 전체를 한 번에 작업으로 만들지 않음
+            tasks.append(asyncio.ensure_future(work(row, fingerprint)))
+            tasks = [task for task in tasks if not task.done()]
+        await asyncio.gather(*tasks)
+
+    summary['seconds'] = round(time.perf_counter()-start, 3)
+    return summary
+
+def bulk_client(llm_model, concurrency, rate):
+    # 앱과 공유하는 클라이언트(초당 LLM_RATE_PER_SEC, 동시 LLM_MAX_IN_FLIGHT) 대신 --concurrency/--rate에 맞춘 전용 클라이언트
+    if isinstance(llm_model, LLMClient):
+        return LLMClient(llm_model.primary, llm_model.secondary, rate=rate, burst=concurrency, max_in_flight=concurrency,
+            timeout=llm_model.timeout, retries=llm_model.retries)
+    return LLMClient(llm_model, rate=rate, burst=concurrency, max_in_flight=concurrency)
+
+def run_bulk(input_path, output_path, concurrency=8, min_prob=0.0, llm_model=None, result_store=None, rate=None,
+             positives_only=False):
+    # rate: 초당 요청 수 한도 (None이면 동시 실행 수만큼)
+    llm_model = bulk_client(llm_model if llm_model is not None else am.load_gemini(), concurrency,
+        rate if rate is not None else float(concurrency))
+    result_store = result_store if result_store is not None else store.load_store()
+    try:
+        return asyncio.run(_run(iter_rows(input_path), llm_model, output_path, concurrency, min_prob, result_store,
+            positives_only))
+    finally:
+        if result_store is not None:
+            result_store.flush()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='초진기록지 일괄 생성')
+    parser.add_argument('input', help='(form_data, diagnosis_type, prob, label) 행이 담긴 .csv 또는 .jsonl')
+    parser.add_argument('--output', required=True, help='결과 .jsonl (이미 있으면 끝난 행은 건너뛰고 이어서 생성)')
+    parser.add_argument('--concurrency', type=int, default=8, help='동시에 생성 중인 최대 기록지 수')
+    parser.add_argument('--rate', type=float, help='초당 LLM 요청 수 한도 (기본: --concurrency와 같음, API 할당량에 맞게 설정)')
+    parser.add_argument('--positives-only', action='store_true', help='양성 라벨(갑상선 암, 뇌종양) 행만 생성')
+    parser.add_argument('--min-prob', type=float, default=0.0, help='양성 행 중 확률이 이 값 미만인 행은 건너뜀 (정상 행에는 적용하지 않음)')
+    args = parser.parse_args(argv)
+
+    summary = run_bulk(args.input, args.output, concurrency=args.concurrency, min_prob=args.min_prob, rate=args.rate,
+        positives_only=args.positives_only)
+    print(json.dumps(summary))
+
+if __name__=='__main__':
+    main()
@@ -0,0 +1,99 @@
+import argparse, json, os, time
+
+import cv2
+import numpy as np
+
+import image_model as im
+from batch_predict import collect_image_paths
+
+THRESHOLDS = (0.05, 0.1, 0.2, 0.3, 0.5)
+
+
+## 라벨링된 이미지 (0/: 정상, 1/: 뇌종양)
+def load_labeled(data_dir):
+    samples = []
+    for name in ('0', '1'):
+        for path in collect_image_paths([os.path.join(data_dir, name)]):
+            samples.append((path, int(name)))
+    return samples
+
+
+## 선별 모델 학습
+def train_triage(data_dir, output_path=im.TRIAGE_PATH, epochs=10, batch_size=32):
+    tf = im.lazy_import('tensorflow')
+
+    samples = load_labeled(data_dir)
+    arrays = [cv2.resize(im.preprocess_image(im.decode_image(path)), im.TRIAGE_SIZE) for path, _ in samples]
+    inputs = np.repeat(np.stack(arrays)[..., None], 3, axis=-1).astype(np.float32)
+    labels = np.array([label for _, label in samples])
+
+    model = im.build_triage_architecture(weights=None)
+    model.compile(optimizer=tf.keras.optimizers.Adam(1e-3), loss='sparse_categorical_crossentropy', metrics=['accuracy'])
+    model.fit(inputs, labels, epochs=epochs, batch_size=batch_size, validation_split=0.1, shuffle=True)
+    model.save_weights(output_path)
+    return output_path
+
+
+## 임계값별 처리량 / 놓침 비율
+def evaluate(eval_dir, thresholds=THRESHOLDS):
+    samples = load_labeled(eval_dir)
+    detector = im.load_model(1)
+    triage = im.load_triage_model()
+
+    rows = []
+    for path, label in samples:
+        image = im.decode_image(path)
+        start = time.perf_counter()
+        score = float(im.triage_scores([image], triage)[0])
+        triage_time = time.perf_counter()-start
+
+        start = time.perf_counter()
+        detections = im.detect([image], detector)[0]
+        detector_time = time.perf_counter()-start
+        rows.append({'label': label, 'score': score, 'triage_time': triage_time, 'detector_time': detector_time,
+            'detector_positive': detections.prob_label[1]=='뇌종양'})
+
+    positives = [row for row in rows if row['label']==1]
+    detector_only_time = sum(row['detector_time'] for row in rows)
+    report = {
+        'images': len(rows),
+        'positives': len(positives),
+        'detector_only': {
+            'images_per_sec': round(len(rows)/detector_only_time, 2) if detector_only_time else None,
+            'miss_rate': round(sum(not row['detector_positive'] for row in positives)/len(positives), 4) if positives else None,
+        },
+        'cascade': [],
+    }
+    for threshold in thresholds:
+        passed = [row for row in rows if row['score']>=threshold]
+        cascade_time = sum(row['triage_time'] for row in rows) + sum(row['detector_time'] for row in passed)
+        triage_misses = sum(row['score']<threshold for row in positives) # 선별 단계에서 놓친 뇌종양
+        total_misses = sum(row['score']<threshold or not row['detector_positive'] for row in positives)
+        report['cascade'].append({
+            'threshold': threshold,
+            'detector_rate': round(len(passed)/len(rows), 4) if rows else None, # YOLO까지 가는 비율
+            'images_per_sec': round(len(rows)/cascade_time, 2) if cascade_time else None,
+            'speedup': round(detector_only_time/cascade_time, 2) if cascade_time else None,
+            'triage_miss_rate': round(triage_misses/len(positives), 4) if positives else None,
+            'miss_rate': round(total_misses/len(positives), 4) if positives else None,
+        })
+    return report
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='뇌 MRI 2단계(선별 -> YOLO) 모드 학습/평가')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    train = subparsers.add_parser('train', help='선별 모델 학습')
+    train.add_argument('data_dir', help='0/, 1/ 하위 폴더로 라벨링된 학습 이미지')
+    train.add_argument('--epochs', type=int, default=10)
+    evaluate_parser = subparsers.add_parser('evaluate', help='임계값별 처리량 / 놓침 비율')
+    evaluate_parser.add_argument('eval_dir', help='0/, 1/ 하위 폴더로 라벨링된 평가 이미지')
+    evaluate_parser.add_argument('--thresholds', type=float, nargs='+', default=list(THRESHOLDS))
+    args = parser.parse_args(argv)
+
+    if args.command=='train':
+        print(train_triage(args.data_dir, epochs=args.epochs))
+    else:
+        print(json.dumps(evaluate(args.eval_dir, args.thresholds), indent=2))
+
+if __name__=='__main__':
+    main()
@@ -0,0 +1,123 @@
+import os
+
+CHAT_TOKEN_BUDGET = int(os.getenv('ESC_CHAT_TOKEN_BUDGET', 4000)) # 한 번에 보내는 입력 토큰 한도
+CHAT_CONTEXT_SHARE = 0.5 # 기록지/환자 요약이 쓸 수 있는 예산 비율
+CHAT_SUMMARY_TOKENS = 300 # 오래된 대화 요약 길이 한도
+
+
+def estimate_tokens(text):
+    # 로컬 근사치 (한글 약 1.5자, 영문 약 4자 = 1토큰). 백엔드가 count_tokens를 제공하면 그 값을 사용
+    ascii_chars = sum(1 for c in text if ord(c)<128)
+    return max(1, round(ascii_chars/4 + (len(text)-ascii_chars)/1.5))
+
+def truncate_to_tokens(text, max_tokens, count=estimate_tokens):
+    # 말줄임표까지 포함해 max_tokens 이내. 아무것도 남길 수 없으면 빈 문자열
+    if not text or count(text)<=max_tokens:
+        return text
+    low, high = 0, len(text)
+    while low<high: # 앞부분을 최대한 남기는 길이 탐색
+        middle = (low+high+1) // 2
+        if count(text[:middle] + ' …')<=max_tokens:
+            low = middle
+        else:
+            high = middle-1
+    return text[:low] + ' …' if low>0 else ''
+
+
+## 대화 세션
+class ChatSession:
+    def __init__(self, llm_model, budget=CHAT_TOKEN_BUDGET, summarize=True):
+        self.llm_model = llm_model
+        self.budget = budget
+        self.summarize = summarize # False면 오래된 대화는 요약 없이 버림
+        self.context = ''
+        self.context_key = None
+        self.summary = ''
+        self.turns = [] # 예산 안에 남아 있는 최근 대화 {'role', 'content'}
+        self.usage = [] # 턴별 {'turn', 'input_tokens', 'output_tokens', 'dropped_turns'}
+
+    def count(self, text):
+        counter = getattr(self.llm_model, 'count_tokens', None)
+        return counter(text) if counter is not None else estimate_tokens(text)
+
+    def seed(self, context, key=None):
+        # 기록지/환자 요약으로 대화 맥락 설정 (같은 key면 유지)
+        if key is not None and key==self.context_key:
+            return
+        self.context = truncate_to_tokens(context, int(self.budget*CHAT_CONTEXT_SHARE), self.count)
+        self.context_key = key
+        self.summary = ''
+        self.turns = []
+
+    def _render(self, question, turns):
+        parts = ['당신은 의료 진단 보조 챗봇입니다. 아래 환자 정보와 초진기록지를 참고해 답변하세요.']
+        if self.context:
+            parts.append(f'[환자 정보 및 초진기록지]\n{self.context}')
+        if self.summary:
+            parts.append(f'[이전 대화 요약]\n{self.summary}')
+        if turns:
+            parts.append('[최근 대화]\n' + '\n'.join(f"{'사용자' if t['role']=='user' else '챗봇'}: {t['content']}" for t in turns))
+        parts.append(f'사용자: {question}\n챗봇:')
+        return '\n\n'.join(parts)
+
+    def _over_budget(self, question):
+        return self.count(self._render(question, self.turns)) - self.budget
+
+    def _check_question(self, question):
+        # 대화/요약을 모두 비워도 (지시문 + 기록지 + 질문)이 예산을 넘으면 잘라 보내지 않고 거부
+        summary, self.summary = self.summary, ''
+        try:
+            over = self.count(self._render(question, [])) - self.budget
+        finally:
+            self.summary = summary
+        if over>0:
+            raise ValueError(f'질문이 너무 깁니다. 약 {over}토큰 줄여서 다시 입력해주세요. (입력 토큰 한도 {self.budget})')
+
+    def _fit(self, question):
+        # 예산을 넘으면 오래된 대화부터 요약/삭제 (요약이 늘어나 다시 넘으면 반복)
+        dropped_total = 0
+        while self._over_budget(question)>0:
+            dropped = []
+            while self.turns and self._over_budget(question)>0:
+                dropped += self.turns[:2] # 질문/답변 한 쌍씩
+                self.turns = self.turns[2:]
+            if not dropped: # 남은 대화가 없으면 요약을 줄임 (다 줄여도 넘으면 요약 삭제)
+                over = self._over_budget(question)
+                self.summary = truncate_to_tokens(self.summary, self.count(self.summary)-over, self.count) if self.summary else ''
+                if self._over_budget(question)>0:
+                    self.summary = ''
+                break
+            dropped_total += len(dropped)
+            if self.summarize:
+                self._summarize(dropped)
+        return dropped_total
+
+    def _summarize(self, dropped):
+        conversation = '\n'.join(f"{'사용자' if t['role']=='user' else '챗봇'}: {t['content']}" for t in dropped)
+        prompt = (f'다음 의료 상담 대화를 {CHAT_SUMMARY_TOKENS}토큰 이내로 핵심만 요약하세요.\n\n'
+            f'[기존 요약]\n{self.summary or "없음"}\n\n[추가 대화]\n{conversation}')
+        try:
+            summary = self.llm_model.generate(prompt)
+        except Exception: # 요약 실패 시 기존 요약 + 잘라낸 대화로 대체
+            summary = f'{self.summary}\n{conversation}'
+        self.summary = truncate_to_tokens(summary.strip(), CHAT_SUMMARY_TOKENS, self.count)
+
+    def stream(self, question):
+        # 답변 조각 반환. 끝까지 받으면 대화 기록/토큰 사용량 갱신
+        self._check_question(question)
+        dropped = self._fit(question)
+        prompt = self._render(question, self.turns)
+        input_tokens = self.count(prompt)
+
+        chunks = []
+        for chunk in self.llm_model.stream(prompt):
+            chunks.append(chunk)
+            yield chunk
+        answer = ''.join(chunks)
+
+        self.turns += [{'role': 'user', 'content': question}, {'role': 'assistant', 'content': answer}]
+        self.usage.append({'turn': len(self.usage)+1, 'input_tokens': input_tokens,
+            'output_tokens': self.count(answer), 'dropped_turns': dropped})
+
+    def ask(self, question):
+        return ''.join(self.stream(question))
@@ -0,0 +1,114 @@
+import argparse, json, os, tempfile
+
+import cv2
+import numpy as np
+
+import image_model as im
+import metrics
+
+SAMPLE_EVERY = int(os.getenv('ESC_CINE_SAMPLE_EVERY', 2)) # n 프레임마다 1장 사용
+DEDUP_DISTANCE = int(os.getenv('ESC_CINE_DEDUP_DISTANCE', 4)) # dHash 해밍 거리 이하면 직전 추론 결과 재사용
+CINE_BATCH_SIZE = 16
+
+
+## 프레임 읽기 / 해시
+def iter_frames(path, sample_every=SAMPLE_EVERY):
+    capture = cv2.VideoCapture(path)
+    try:
+        index = 0
+        while True:
+            ok = capture.grab() # 건너뛸 프레임은 디코드하지 않음
+            if not ok:
+                break
+            if index%sample_every==0:
+                ok, frame = capture.retrieve()
+                if ok:
+                    yield index, cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+            index += 1
+    finally:
+        capture.release()
+
+def dhash(frame, size=8):
+    # 차이 해시: 축소한 그레이스케일에서 인접 픽셀 밝기 비교 (64비트)
+    gray = cv2.cvtColor(frame, cv2.COLOR_RGB2GRAY) if frame.ndim==3 else frame
+    small = cv2.resize(gray, (size+1, size), interpolation=cv2.INTER_AREA)
+    bits = (small[:, 1:]>small[:, :-1]).flatten()
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+def hamming(a, b):
+    return bin(a^b).count('1')
+
+
+## 클립 단위 예측
+def predict_clip(path, model, sample_every=SAMPLE_EVERY, max_distance=DEDUP_DISTANCE, batch_size=CINE_BATCH_SIZE):
+    im.require_local_model(model, '초음파 영상 분석')
+    frames = [] # (프레임 번호, 추론할 프레임 순번 또는 None)
+    pending = [] # 추론할 전처리 배열
+    last_hash = None
+    for index, frame in iter_frames(path, sample_every):
+        frame_hash = dhash(frame)
+        if last_hash is not None and hamming(frame_hash, last_hash)<=max_distance:
+            frames.append((index, None)) # 직전 추론 프레임과 거의 같음
+            continue
+        last_hash = frame_hash
+        frames.append((index, len(pending)))
+        pending.append(im.preprocess_for_model(frame, 0))
+    if not frames: # 코덱 미지원/손상 파일: 0%로 정상 판정하지 않도록 오류
+        raise ValueError('영상에서 프레임을 읽을 수 없습니다 (지원하지 않는 코덱이거나 손상된 파일)')
+
+    # 중복 제거 후 남은 프레임만 배치 추론
+    probabilities = []
+    for start in range(0, len(pending), batch_size):
+        batch = np.repeat(np.stack(pending[start:start+batch_size])[..., None], 3, axis=-1).astype(np.float32)
+        with metrics.timed('forward'):
+            probabilities += [float(row[1]) for row in model.predict(batch, batch_size=len(batch), verbose=0)]
+
+    per_frame = []
+    current = None
+    for index, position in frames:
+        if position is not None:
+            current = probabilities[position]
+        per_frame.append({'frame': index, 'probability': current, 'inferred': position is not None})
+
+    values = np.array([f['probability'] for f in per_frame])
+    prob, label = im.classification_result(float(values.mean()))
+    return {
+        'prob': float(prob),
+        'label': label,
+        'max_probability': round(float(values.max()), 4),
+        'frames_sampled': len(per_frame),
+        'forward_passes': len(pending),
+        'forward_passes_saved': len(per_frame)-len(pending),
+        'frames': per_frame,
+    }
+
+def predict_uploaded_clip(uploaded_bytes, model, suffix='.mp4', **kwargs):
+    # VideoCapture는 파일 경로가 필요하므로 임시 파일로 저장
+    with tempfile.NamedTemporaryFile(suffix=suffix) as f:
+        f.write(uploaded_bytes)
+        f.flush()
+        return predict_clip(f.name, model, **kwargs)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='갑상선 초음파 영상 클립 진단 (중복 프레임 생략)')
+    parser.add_argument('clips', nargs='+')
+    parser.add_argument('--sample-every', type=int, default=SAMPLE_EVERY)
+    parser.add_argument('--max-distance', type=int, default=DEDUP_DISTANCE)
+    args = parser.parse_args(argv)
+
+    model = im.load_model(0)
+    reports = []
+    for clip in args.clips:
+        try:
+            result = predict_clip(clip, model, args.sample_every, args.max_distance)
+        except ValueError as e:
+            reports.append({'clip': clip, 'error': str(e), 'frames_sampled': 0, 'forward_passes_saved': 0})
+            continue
+        reports.append({'clip': clip, **{k: v for k, v in result.items() if k!='frames'}})
+    total = sum(r['frames_sampled'] for r in reports)
+    saved = sum(r['forward_passes_saved'] for r in reports)
+    print(json.dumps({'clips': reports, 'frames_sampled': total, 'forward_passes_saved': saved,
+        'saved_ratio': round(saved/total, 4) if total else 0.0}, ensure_ascii=False, indent=2))
+
+if __name__=='__main__':
+    main()
@@ -0,0 +1,54 @@
+import argparse, json, time
+
+import numpy as np
+
+import image_model as im
+
+
+## .h5 가중치 -> 단일 .keras 파일 변환
+def convert(weights_path=im.MODEL_PATH, output_path=im.CLASSIFIER_PATH):
+    model = im.build_classifier_architecture(weights=None)
+    model.load_weights(weights_path)
+    model.save(output_path)
+    return model
+
+def _timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return result, round(time.perf_counter()-start, 3)
+
+def measure_load_times(weights_path=im.MODEL_PATH, output_path=im.CLASSIFIER_PATH, include_imagenet=False):
+    # 로드 방식별 소요 시간 (초)
+    tf = im.lazy_import('tensorflow')
+    times = {}
+
+    def load_h5(weights):
+        model = im.build_classifier_architecture(weights=weights)
+        model.load_weights(weights_path)
+        return model
+
+    if include_imagenet: # 기존 방식 (네트워크 필요)
+        _, times['imagenet+h5'] = _timed(lambda: load_h5('imagenet'))
+    reference, times['none+h5'] = _timed(lambda: load_h5(None))
+    converted, times['keras'] = _timed(lambda: tf.keras.models.load_model(output_path, compile=False))
+
+    # 변환 전후 출력 비교
+    sample = np.random.default_rng(0).uniform(0, 255, (4, 180, 180, 3)).astype(np.float32)
+    diff = np.abs(reference.predict(sample, verbose=0) - converted.predict(sample, verbose=0)).max()
+    return {'seconds': times, 'max_abs_diff': float(diff)}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='갑상선 분류 모델을 단일 .keras 파일로 변환')
+    parser.add_argument('--weights', default=im.MODEL_PATH)
+    parser.add_argument('--output', default=im.CLASSIFIER_PATH)
+    parser.add_argument('--measure', action='store_true', help='변환 후 로드 시간 비교')
+    parser.add_argument('--include-imagenet', action='store_true', help="비교에 기존 weights='imagenet' 방식 포함 (네트워크 필요)")
+    args = parser.parse_args(argv)
+
+    convert(args.weights, args.output)
+    print(f'saved: {args.output}')
+    if args.measure:
+        print(json.dumps(measure_load_times(args.weights, args.output, args.include_imagenet), indent=2))
+
+if __name__=='__main__':
+    main()
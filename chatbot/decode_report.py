@@ -0,0 +1,59 @@
+import argparse, io, json, multiprocessing, resource, time
+
+from PIL import Image
+
+import image_model as im
+from stub_models import synthetic_image
+
+SIZES = ((4000, 3000), (8000, 6000))
+
+
+## 기존 경로 vs 축소 디코드 경로
+def _legacy_path(data, diagnosis_type):
+    image = Image.open(io.BytesIO(data)) # main()의 기존 방식: 원본 해상도 그대로 전처리
+    return im.preprocess_for_model(image, diagnosis_type)
+
+def _bounded_path(data, diagnosis_type):
+    return im.preprocess_for_model(im.decode_image(data, max_bytes=len(data)), diagnosis_type)
+
+PATHS = {'legacy': _legacy_path, 'bounded': _bounded_path}
+
+def _measure(args):
+    # 최대 RSS는 프로세스 단위라서 경로마다 새 프로세스에서 측정
+    path_name, data, diagnosis_type = args
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    PATHS[path_name](data, diagnosis_type)
+    elapsed = time.perf_counter()-start
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return {'latency_ms': round(elapsed*1000, 1), 'peak_rss_increase_mb': round((rss_after-rss_before)/1024, 1)}
+
+def encode(image, image_format):
+    buffer = io.BytesIO()
+    image.save(buffer, format=image_format, **({'quality': 90} if image_format=='JPEG' else {}))
+    return buffer.getvalue()
+
+def run(sizes=SIZES, formats=('JPEG', 'BMP'), diagnosis_types=(0, 1)):
+    context = multiprocessing.get_context('spawn')
+    rows = []
+    for width, height in sizes:
+        for image_format in formats:
+            for diagnosis_type in diagnosis_types:
+                data = encode(synthetic_image(diagnosis_type, (width, height)), image_format)
+                row = {'size': f'{width}x{height}', 'format': image_format, 'type': diagnosis_type, 'file_mb': round(len(data)/2**20, 1)}
+                for path_name in PATHS:
+                    with context.Pool(1) as pool:
+                        row[path_name] = pool.apply(_measure, ((path_name, data, diagnosis_type),))
+                rows.append(row)
+    return rows
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='대용량 이미지 디코드 메모리/지연 시간 비교')
+    parser.add_argument('--sizes', nargs='+', help='예: 4000x3000 8000x6000')
+    args = parser.parse_args(argv)
+
+    sizes = [tuple(int(v) for v in size.split('x')) for size in args.sizes] if args.sizes else SIZES
+    print(json.dumps(run(sizes), indent=2))
+
+if __name__=='__main__':
+    main()
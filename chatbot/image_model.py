@@ -1,41 +1,264 @@
+import base64, hashlib, importlib, io, json, os, struct, sys, threading, time, urllib.error, urllib.request
+from collections import OrderedDict
+
 import cv2
 from PIL import Image
 import numpy as np
 import streamlit as st
 
-import tensorflow as tf
-from tensorflow.keras import layers, models
-from tensorflow.keras.applications import ConvNeXtTiny
+import metrics
+import store
 
-import torch
-import torchvision.transforms as T
-from ultralytics import YOLO
+# TensorFlow / ultralytics(torch)는 해당 진단 종류를 처음 요청할 때 import
 
 MODEL_PATH = 'model/250218_base-model_ep-30.h5'
+CLASSIFIER_PATH = 'model/250218_base-model_ep-30.keras' # convert_model.py로 만든 단일 파일 (있으면 우선 사용)
 YOLO_PATH = 'model/final/250319_yolov8_ep100/weights/best.pt'
 
-@st.cache_resource
-def load_model(diagnosis_type):
-    if diagnosis_type==0:
-        conv_model = ConvNeXtTiny(
-            include_top=False,
-            input_shape=(180, 180, 3),
-            weights='imagenet'
+MODEL_SERVER_URL = os.getenv('ESC_MODEL_SERVER', 'http://127.0.0.1:8765') # ESC_MODEL_BACKEND=remote일 때 사용
+MODEL_SERVER_TIMEOUT = float(os.getenv('ESC_MODEL_SERVER_TIMEOUT', 30))
+REMOTE_VERSION_TTL = 30 # 모델 서버 버전 태그 캐시 시간(초)
+
+WORKING_MAX_SIDE = int(os.getenv('ESC_WORKING_MAX_SIDE', 1024)) # 디코드 직후 축소할 긴 변 크기 (YOLO 입력 512 이상)
+MAX_UPLOAD_BYTES = int(os.getenv('ESC_MAX_UPLOAD_BYTES', 64 * 1024 * 1024))
+MAX_DECODE_PIXELS = int(os.getenv('ESC_MAX_DECODE_PIXELS', 4096 * 4096)) # 축소 없이 전체 디코드해야 하는 형식의 한도
+
+TRIAGE_PATH = 'model/triage_mobilenetv3-small_128.h5' # cascade.py train으로 생성
+TRIAGE_SIZE = (128, 128)
+CASCADE_ENABLED = bool(os.getenv('ESC_CASCADE')) # 뇌 MRI: 선별 모델 점수가 임계값 이상일 때만 YOLO 실행
+CASCADE_THRESHOLD = float(os.getenv('ESC_CASCADE_THRESHOLD', 0.2))
+
+OVERLAY_STYLE = os.getenv('ESC_OVERLAY_STYLE', 'fast') # fast: 전처리 이미지에 박스만 그림, full: ultralytics plot()
+
+CACHE_MAX_BYTES = int(os.getenv('ESC_CACHE_MAX_BYTES', 256 * 1024 * 1024)) # 결과 캐시 메모리 한도
+CACHE_DIR = os.getenv('ESC_CACHE_DIR') # 지정 시 디스크에도 저장 (재시작 후 유지)
+CACHE_DISK_MAX_BYTES = int(os.getenv('ESC_CACHE_DISK_MAX_BYTES', 1024 * 1024 * 1024)) # 디스크 캐시 한도 (넘으면 오래 안 쓴 파일부터 삭제)
+
+MODEL_BACKEND = os.getenv('ESC_MODEL_BACKEND', 'native') # native: Keras/ultralytics, onnx: ONNX Runtime, onnx-int8: INT8 양자화, remote: 모델 서버
+
+STARTUP_TIMES = {} # 'import:모듈' / 'load:모델' -> 소요 시간(초)
+_WARMUP_STARTED = set()
+_REMOTE_VERSIONS = {} # (서버 URL, 진단 종류) -> (버전 태그, 조회 시각)
+
+
+## 지연 로딩
+def lazy_import(module_name):
+    # 처음 import할 때만 소요 시간 기록
+    if module_name in sys.modules:
+        return sys.modules[module_name]
+    start = time.perf_counter()
+    module = importlib.import_module(module_name)
+    STARTUP_TIMES[f'import:{module_name}'] = round(time.perf_counter()-start, 3)
+    return module
+
+def classifier_path():
+    return CLASSIFIER_PATH if os.path.exists(CLASSIFIER_PATH) else MODEL_PATH
+
+def build_classifier_architecture(weights=None):
+    # weights=None: ImageNet 가중치를 받지 않음 (어차피 학습 가중치로 덮어씀)
+    tf = lazy_import('tensorflow')
+    layers, models = tf.keras.layers, tf.keras.models
+
+    conv_model = tf.keras.applications.ConvNeXtTiny(
+        include_top=False,
+        input_shape=(180, 180, 3),
+        weights=weights
+    )
+    model = models.Sequential([
+        conv_model,
+        layers.GlobalAveragePooling2D(),
+        layers.Dense(128, activation='relu'),
+        layers.Dropout(0.3),
+        layers.Dense(2, activation='softmax')
+    ])
+    return model
+
+def _build_classifier(path=None):
+    tf = lazy_import('tensorflow')
+
+    path = path or classifier_path()
+    start = time.perf_counter()
+    if path.endswith('.keras'): # 구조 + 가중치가 담긴 단일 파일
+        model = tf.keras.models.load_model(path, compile=False)
+    else:
+        model = build_classifier_architecture()
+        model.load_weights(path) # 가중치 로드
+    STARTUP_TIMES['load:classifier'] = round(time.perf_counter()-start, 3)
+    return model
+
+class CompiledClassifier:
+    # model.predict 대신 입력 시그니처를 고정한 tf.function 직접 호출 (로드 시 1회 트레이스)
+    def __init__(self, model, input_shape=(180, 180, 3)):
+        tf = lazy_import('tensorflow')
+        self.model = model
+        self._infer = tf.function(
+            lambda inputs: model(inputs, training=False),
+            input_signature=[tf.TensorSpec((None, *input_shape), tf.float32)]
         )
-        model = models.Sequential([
-            conv_model,
-            layers.GlobalAveragePooling2D(),
-            layers.Dense(128, activation='relu'),
-            layers.Dropout(0.3),
-            layers.Dense(2, activation='softmax')
-        ])
-
-        model.load_weights(MODEL_PATH) # 가중치 로드
+        self._infer.get_concrete_function()
+
+    def predict(self, inputs, batch_size=None, verbose=0): # Keras model.predict와 같은 호출 방식
+        tf = lazy_import('tensorflow')
+        return self._infer(tf.convert_to_tensor(inputs, dtype=tf.float32)).numpy()
+
+    def __getattr__(self, name):
+        return getattr(self.model, name)
+
+def build_triage_architecture(weights=None):
+    # 뇌 MRI 1차 선별용: 갑상선 분류 모델과 같은 구조의 작은 버전 (MobileNetV3Small, 128x128)
+    tf = lazy_import('tensorflow')
+    layers, models = tf.keras.layers, tf.keras.models
+
+    base_model = tf.keras.applications.MobileNetV3Small(
+        include_top=False,
+        input_shape=(*TRIAGE_SIZE, 3),
+        weights=weights
+    )
+    model = models.Sequential([
+        base_model,
+        layers.GlobalAveragePooling2D(),
+        layers.Dense(64, activation='relu'),
+        layers.Dropout(0.3),
+        layers.Dense(2, activation='softmax')
+    ])
+    return model
+
+@st.cache_resource
+def load_triage_model():
+    start = time.perf_counter()
+    model = build_triage_architecture()
+    model.load_weights(TRIAGE_PATH)
+    STARTUP_TIMES['load:triage'] = round(time.perf_counter()-start, 3)
+    return CompiledClassifier(model, (*TRIAGE_SIZE, 3))
+
+def _build_detector(path=None):
+    ultralytics = lazy_import('ultralytics')
+
+    start = time.perf_counter()
+    model = ultralytics.YOLO(path or YOLO_PATH)
+    STARTUP_TIMES['load:detector'] = round(time.perf_counter()-start, 3)
+    return model
+
+@st.cache_resource
+def load_model(diagnosis_type, backend=None):
+    backend = backend or MODEL_BACKEND
+    if backend=='remote': # 모델은 model_server.py 프로세스가 보유
+        model = RemoteModel(MODEL_SERVER_URL, diagnosis_type)
+    elif backend in ('onnx', 'onnx-int8'): # CPU 경량 런타임
+        import onnx_backend
+        model = onnx_backend.load_onnx_model(diagnosis_type, quantized=backend=='onnx-int8')
+    elif diagnosis_type==0:
+        model = CompiledClassifier(_build_classifier())
     else:
-        model = YOLO(YOLO_PATH)
+        model = _build_detector()
 
     return model
 
+class RemoteModel:
+    # model_server.py 클라이언트 (이미지 1장 단위 결과만 제공: 영상/시리즈처럼 raw 출력이 필요한 경로는 지원하지 않음)
+    def __init__(self, url, diagnosis_type, timeout=MODEL_SERVER_TIMEOUT):
+        self.url = url.rstrip('/')
+        self.diagnosis_type = diagnosis_type
+        self.timeout = timeout
+
+    def predict_bytes(self, image_bytes):
+        request = urllib.request.Request(f'{self.url}/predict?type={self.diagnosis_type}', data=image_bytes,
+            headers={'Content-Type': 'application/octet-stream'}, method='POST')
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                payload = json.loads(response.read())
+        except urllib.error.HTTPError as e: # 서버 오류(500 등)는 본문의 {'error': ...}를 그대로 전달
+            try:
+                payload = json.loads(e.read())
+            except ValueError:
+                payload = {}
+            raise RuntimeError(f'model server: {payload.get("error", f"HTTP {e.code}")}') from None
+        if 'error' in payload:
+            raise RuntimeError(f'model server: {payload["error"]}')
+        if not payload['has_overlay']:
+            return payload['prob'], payload['label']
+        overlay = Image.open(io.BytesIO(base64.b64decode(payload['overlay'])))
+        overlay.load()
+        return payload['prob'], payload['label'], overlay
+
+    def predict_image(self, image):
+        buffer = io.BytesIO()
+        image.save(buffer, format='PNG')
+        return self.predict_bytes(buffer.getvalue())
+
+def start_warmup(diagnosis_type):
+    # 사용 가능성이 높은 모델을 백그라운드에서 미리 로드 (프로세스당 진단 종류별 1회)
+    if diagnosis_type in _WARMUP_STARTED:
+        return
+    _WARMUP_STARTED.add(diagnosis_type)
+    threading.Thread(target=load_model, args=(diagnosis_type,), name=f'warmup-{diagnosis_type}', daemon=True).start()
+
+def startup_report():
+    imports = {k[len('import:'):]: v for k, v in STARTUP_TIMES.items() if k.startswith('import:')}
+    loads = {k[len('load:'):]: v for k, v in STARTUP_TIMES.items() if k.startswith('load:')}
+    return {'import': imports, 'load': loads, 'total': round(sum(STARTUP_TIMES.values()), 3)}
+
+## 디코드
+def decode_image(source, max_side=WORKING_MAX_SIDE, max_bytes=MAX_UPLOAD_BYTES, max_pixels=MAX_DECODE_PIXELS):
+    # source: 바이트 또는 파일 경로. 원본 해상도 전체를 메모리에 올리지 않고 작업 해상도로 바로 디코드
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        size = len(source)
+        data = source
+    else:
+        size = os.path.getsize(source)
+        data = None
+    if size>max_bytes:
+        raise ValueError(f'이미지 파일이 너무 큽니다 ({size/2**20:.1f}MB > {max_bytes/2**20:.0f}MB)')
+
+    image = Image.open(io.BytesIO(data) if data is not None else source)
+    width, height = image.size
+    factor = max(1, -(-max(width, height) // max_side)) # 축소 배율 (올림)
+
+    if image.format=='BMP' and factor>1:
+        array = _decode_bmp_strided(data if data is not None else np.memmap(source, dtype=np.uint8, mode='r'), factor)
+        if array is not None:
+            image.close()
+            return Image.fromarray(array)
+
+    if image.format=='JPEG' and factor>1:
+        image.draft('RGB', (width//factor, height//factor)) # DCT 단계에서 1/2, 1/4, 1/8 축소 디코드
+    if image.size[0]*image.size[1]>max_pixels:
+        raise ValueError(f'이미지 해상도가 너무 큽니다 ({width}x{height})')
+
+    image = image.convert('RGB')
+    if max(image.size)>max_side:
+        image.thumbnail((max_side, max_side), Image.BILINEAR)
+    return image
+
+def _decode_bmp_strided(data, factor):
+    # 무압축 24/32비트 BMP: 필요한 행/열만 읽음 (파일은 메모리 맵, 업로드 바이트는 복사 없이 참조)
+    buffer = np.frombuffer(data, dtype=np.uint8) if not isinstance(data, np.ndarray) else data
+    header = buffer[:54].tobytes()
+    if len(header)<54 or header[:2]!=b'BM':
+        return None
+    offset = int.from_bytes(header[10:14], 'little')
+    info_size = int.from_bytes(header[14:18], 'little')
+    width = int.from_bytes(header[18:22], 'little', signed=True)
+    height = int.from_bytes(header[22:26], 'little', signed=True)
+    bits = int.from_bytes(header[28:30], 'little')
+    compression = int.from_bytes(header[30:34], 'little')
+    if bits not in (24, 32) or compression not in (0, 3) or width<=0 or height==0:
+        return None # 팔레트/압축 BMP는 PIL로 처리
+    if info_size<40 or offset<14+info_size:
+        return None
+
+    channels = bits // 8
+    stride = (width*channels + 3) & ~3 # 행은 4바이트 정렬
+    rows = abs(height)
+    if len(buffer)<offset+stride*rows: # 헤더가 실제 데이터보다 크게 주장하면 버퍼 밖을 읽게 되므로 PIL로 처리 (잘린 파일은 PIL이 오류 발생)
+        return None
+    pixels = np.lib.stride_tricks.as_strided(buffer[offset:], shape=(rows, width, channels),
+        strides=(stride, channels, 1), writeable=False)
+    if height>0: # bottom-up 저장
+        pixels = pixels[::-1]
+    reduced = np.ascontiguousarray(pixels[::factor, ::factor, 2::-1]) # BGR(A) -> RGB
+    return reduced
+
 def image_to_tensor(image, img_size=(180, 180)):
     try:
         # 전처리 과정에서 그레이스케일 이미지 얻기
@@ -46,7 +269,8 @@ def image_to_tensor(image, img_size=(180, 180)):
         prep_image_rgb = np.stack([prep_image, prep_image, prep_image], axis=-1)
         prep_image_rgb = np.expand_dims(prep_image_rgb, axis=0)  # 배치 차원 추가
         
-        return tf.convert_to_tensor(prep_image_rgb, dtype=tf.float32)
+        # float32 NumPy 배치 (TensorFlow 텐서 변환은 CompiledClassifier.predict에서만 -> ONNX 백엔드는 TF를 import하지 않음)
+        return prep_image_rgb.astype(np.float32)
     except Exception as e:
         print(f'Error in image_to_tensor: {e}')
         print(f'Image shape: {image.shape if hasattr(image, "shape") else "Unknown"}')
@@ -98,39 +322,472 @@ def preprocess_image_for_yolo(image, size=(512, 512)):
 
     return Image.fromarray(resized)  # YOLO는 PIL도 받음
 
-def predict_image(image, model, diagnosis_type):
+def _gray_lab_luts():
+    # 그레이스케일 입력은 a=b=128이므로 GRAY->RGB->LAB / LAB->RGB 변환을 256칸 룩업 테이블로 대체
+    ramp = np.arange(256, dtype=np.uint8).reshape(1, 256)
+    lightness = cv2.cvtColor(cv2.cvtColor(ramp, cv2.COLOR_GRAY2RGB), cv2.COLOR_RGB2LAB)[0, :, 0]
+    lab = np.stack([ramp[0], np.full(256, 128, np.uint8), np.full(256, 128, np.uint8)], axis=-1).reshape(1, 256, 3)
+    rgb = cv2.cvtColor(lab, cv2.COLOR_LAB2RGB)[0]
+    return lightness, rgb
+
+_GRAY_TO_L, _L_TO_RGB = _gray_lab_luts()
+
+def preprocess_slices_for_yolo(slices, size=(512, 512)):
+    # (N, H, W) uint8 그레이스케일 슬라이스 배치 -> (N, 512, 512, 3) RGB
+    # preprocess_image_for_yolo와 같은 결과. 색 변환은 배치 전체에 한 번에, CLAHE/리사이즈만 슬라이스별
+    lightness = _GRAY_TO_L[slices]
+    clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
+    enhanced = _L_TO_RGB[np.stack([clahe.apply(l) for l in lightness])]
+    return np.stack([cv2.resize(rgb, size) for rgb in enhanced])
+
+POSITIVE_LABELS = ('갑상선 암', '뇌종양') # classification_result / detection_result의 양성 라벨
+
+def classification_result(probability):
+    if probability>=0.5:
+        return round(probability*100, 2), '갑상선 암'
+    else:
+        return round((1-probability)*100, 2), '정상'
+
+def detection_arrays(result):
+    # YOLO 결과 -> (boxes, scores, classes) NumPy 배열
+    detections = result.boxes
+    if detections is None or len(detections)==0:
+        return np.zeros((0, 4), dtype=np.float32), np.zeros(0, dtype=np.float32), np.zeros(0, dtype=int)
+
+    boxes = _to_numpy(detections.xyxy)
+    scores = _to_numpy(detections.conf)
+    classes = _to_numpy(detections.cls).astype(int)
+    return boxes, scores, classes
+
+def _to_numpy(values): # torch 텐서 / NumPy 배열 모두 허용
+    return values.cpu().numpy() if hasattr(values, 'cpu') else np.asarray(values)
+
+def detection_result(scores, classes):
+    tumor_scores = [s for s, c in zip(scores, classes) if c == 1]  # 뇌종양 클래스 ID=1
+
+    if len(tumor_scores)==0:
+        max_neg_score = max(scores) if len(scores)>0 else 0.0
+        return round(max_neg_score*100, 2), '정상'
+
+    max_tumor_score = max(tumor_scores)
+    return round(max_tumor_score*100, 2), '뇌종양'
+
+## 검출 결과
+class Detections:
+    # 박스/점수/클래스 NumPy 배열 + 전처리된 입력 이미지. 시각화는 필요할 때만 생성
+    def __init__(self, boxes, scores, classes, image, names=None, result=None):
+        self.boxes = boxes # (N, 4) xyxy, image 좌표
+        self.scores = scores # (N,)
+        self.classes = classes # (N,)
+        self.image = image # preprocess_image_for_yolo 결과 (PIL, 선별 단계에서 건너뛴 경우 None)
+        self.names = names or {}
+        self._result = result # ultralytics 원본 결과 (style='full' 렌더링용)
+
+    @classmethod
+    def from_result(cls, result, image):
+        boxes, scores, classes = detection_arrays(result)
+        return cls(boxes, scores, classes, image, getattr(result, 'names', None), result)
+
+    @classmethod
+    def from_boxes(cls, boxes, image):
+        # to_boxes() 형식(저장소 등)에서 복원
+        return cls(np.array([box['xyxy'] for box in boxes], dtype=np.float32).reshape(-1, 4),
+            np.array([box['score'] for box in boxes], dtype=np.float32),
+            np.array([box['class'] for box in boxes], dtype=int), image)
+
+    def __len__(self):
+        return len(self.scores)
+
+    @property
+    def prob_label(self):
+        return detection_result(self.scores, self.classes)
+
+    def to_boxes(self):
+        return [
+            {'xyxy': [round(float(v), 1) for v in box], 'score': round(float(score), 4), 'class': int(cls)}
+            for box, score, cls in zip(self.boxes, self.scores, self.classes)
+        ]
+
+    def render(self, style=None, max_size=None):
+        # style='fast': 전처리 이미지 위에 cv2로 박스만 그림 / 'full': ultralytics plot()
+        # max_size 지정 시 긴 변 기준으로 축소한 썸네일에 그림
+        style = style or OVERLAY_STYLE
+        with metrics.timed('render'):
+            if style=='full' and self._result is not None:
+                overlay = Image.fromarray(cv2.cvtColor(self._result.plot(), cv2.COLOR_BGR2RGB))
+                if max_size:
+                    overlay.thumbnail((max_size, max_size))
+                return overlay
+
+            canvas = np.array(self.image)
+            scale = 1.0
+            if max_size and max(canvas.shape[:2])>max_size:
+                scale = max_size / max(canvas.shape[:2])
+                canvas = cv2.resize(canvas, (round(canvas.shape[1]*scale), round(canvas.shape[0]*scale)), interpolation=cv2.INTER_AREA)
+            draw_boxes(canvas, self.boxes*scale, self.scores, self.classes, self.names, color_order='rgb')
+            return Image.fromarray(canvas)
+
+def draw_boxes(canvas, boxes, scores, classes, names, thickness=2, color_order='bgr'):
+    for box, score, cls in zip(boxes, scores, classes):
+        x1, y1, x2, y2 = [int(round(v)) for v in box]
+        color = (56, 56, 255) if int(cls)==1 else (255, 157, 151) # BGR (뇌종양: 빨강)
+        if color_order=='rgb':
+            color = color[::-1]
+        cv2.rectangle(canvas, (x1, y1), (x2, y2), color, thickness)
+        cv2.putText(canvas, f'{names.get(int(cls), int(cls))} {score:.2f}', (x1, max(y1-4, 12)),
+            cv2.FONT_HERSHEY_SIMPLEX, 0.5, color, 1, cv2.LINE_AA)
+    return canvas
+
+def detect(images, model):
+    # 전처리 + YOLO forward만 수행 (시각화 없음)
+    with metrics.timed('preprocess_yolo'):
+        preprocessed_images = [preprocess_image_for_yolo(image) for image in images]
+    with metrics.timed('forward_yolo'):
+        results = model(preprocessed_images, verbose=False)
+    return [Detections.from_result(result, image) for result, image in zip(results, preprocessed_images)]
+
+def _detection_output(detections, render):
+    if len(detections)==0: # 검출 없음: 전처리 이미지 그대로
+        return 0.0, '정상', detections.image if render else detections
+    prob, label = detections.prob_label
+    return prob, label, detections.render() if render else detections
+
+def predict_image(image, model, diagnosis_type, render=True):
+    # 뇌 MRI: render=False면 세 번째 값으로 시각화 이미지 대신 Detections 반환
+    if isinstance(model, RemoteModel): # 모델 서버에 위임
+        return model.predict_image(image)
+
     if diagnosis_type==0:
-        input_tensor = image_to_tensor(image)
-        prediction = model.predict(input_tensor)
+        with metrics.timed('preprocess'):
+            input_tensor = image_to_tensor(image)
+        with metrics.timed('forward'):
+            prediction = model.predict(input_tensor)
         probability = prediction[0][1] # 확률값
         
-        if probability>=0.5:
-            return round(probability*100, 2), '갑상선 암'
-        else:
-            return round((1-probability)*100, 2), '정상'
+        return classification_result(probability)
+    elif CASCADE_ENABLED:
+        return predict_cascade(image, model, load_triage_model(), CASCADE_THRESHOLD, render)
     else:
-        preprocessed_image = preprocess_image_for_yolo(image)
-        results = model(preprocessed_image)
-        detections = results[0].boxes
+        return _detection_output(detect([image], model)[0], render)
 
-        if detections is None or len(detections)==0:
-            return 0.0, '정상', preprocessed_image
+def triage_scores(images, triage_model):
+    # 선별 모델의 뇌종양 확률 (0~1)
+    with metrics.timed('preprocess_triage'):
+        arrays = [cv2.resize(preprocess_image(image), TRIAGE_SIZE) for image in images]
+        batch = np.repeat(np.stack(arrays)[..., None], 3, axis=-1).astype(np.float32)
+    with metrics.timed('forward_triage'):
+        prediction = triage_model.predict(batch, batch_size=len(images), verbose=0)
+    return prediction[:, 1]
 
-        # 클래스 기반 판단
-        boxes = detections.xyxy.cpu().numpy()
-        scores = detections.conf.cpu().numpy()
-        classes = detections.cls.cpu().numpy().astype(int)
+def predict_cascade(image, detector, triage_model, threshold=CASCADE_THRESHOLD, render=True):
+    return predict_cascade_batch([image], detector, triage_model, threshold, render)[0]
 
-        tumor_scores = [s for s, c in zip(scores, classes) if c == 1]  # 뇌종양 클래스 ID=1
+def predict_cascade_batch(images, detector, triage_model, threshold=CASCADE_THRESHOLD, render=True):
+    # 선별 점수가 임계값 미만이면 YOLO를 건너뛰고 정상으로 판단 (임계값 이상인 이미지만 모아서 한 번에 검출)
+    scores = [float(score) for score in triage_scores(images, triage_model)]
+    for score in scores:
+        metrics.cache_event('cascade_skip', score<threshold)
+    positive = [i for i, score in enumerate(scores) if score>=threshold]
+    outputs = [None] * len(images)
+    if positive:
+        for i, detections in zip(positive, detect([images[i] for i in positive], detector)):
+            outputs[i] = _detection_output(detections, render)
 
-        # 시각화 이미지
-        visualized = results[0].plot()
-        visualized_rgb = cv2.cvtColor(visualized, cv2.COLOR_BGR2RGB)
-        visualized_pil = Image.fromarray(visualized_rgb)
+    for i, score in enumerate(scores):
+        if outputs[i] is not None:
+            continue
+        prob = round((1-score)*100, 2)
+        if render:
+            outputs[i] = (prob, '정상', preprocess_image_for_yolo(images[i]))
+        else: # 건너뛴 이미지는 전처리하지 않음 (image=None, 화면에 필요하면 호출한 쪽에서 생성)
+            outputs[i] = (prob, '정상', Detections(np.zeros((0, 4), dtype=np.float32), np.zeros(0, dtype=np.float32),
+                np.zeros(0, dtype=int), None))
+    return outputs
 
-        if len(tumor_scores)==0:
-            max_neg_score = max(scores) if len(scores)>0 else 0.0
-            return round(max_neg_score*100, 2), '정상', visualized_pil
-        
-        max_tumor_score = max(tumor_scores)
-        return round(max_tumor_score*100, 2), '뇌종양', visualized_pil
\ No newline at end of file
+def predict_image_batch(images, model, diagnosis_type, render=True):
+    # predict_image와 같은 형식의 결과를 여러 이미지에 대해 한 번의 forward로 계산
+    if len(images)==0:
+        return []
+
+    if diagnosis_type==0:
+        with metrics.timed('preprocess'):
+            arrays = [preprocess_for_model(image, 0) for image in images]
+        return [(output['prob'], output['label']) for output in predict_preprocessed(arrays, model, 0)]
+    elif CASCADE_ENABLED: # predict_image와 같은 선별 단계 (model_version 태그와 일치)
+        return predict_cascade_batch(images, model, load_triage_model(), CASCADE_THRESHOLD, render)
+    else:
+        return [_detection_output(detections, render) for detections in detect(images, model)]
+
+def preprocess_for_model(image, diagnosis_type):
+    # 모델 입력 직전 배열: 분류 (180, 180) 그레이스케일 / YOLO (512, 512, 3) RGB
+    if diagnosis_type==0:
+        return cv2.resize(preprocess_image(image), (180, 180))
+    else:
+        return np.asarray(preprocess_image_for_yolo(image))
+
+def predict_preprocessed(arrays, model, diagnosis_type):
+    # preprocess_for_model 결과 배치 추론: 이미지별 {'prob', 'label', 'boxes'} 목록 반환 (시각화 없음)
+    if len(arrays)==0:
+        return []
+
+    if diagnosis_type==0:
+        batch = np.repeat(np.stack(arrays)[..., None], 3, axis=-1).astype(np.float32) # 그레이스케일 -> 3채널
+        with metrics.timed('forward'):
+            prediction = model.predict(batch, batch_size=len(arrays), verbose=0)
+        outputs = []
+        for row in prediction:
+            prob, label = classification_result(row[1])
+            outputs.append({'prob': float(prob), 'label': label, 'boxes': []})
+        return outputs
+    else:
+        images = [Image.fromarray(array) for array in arrays] # NumPy는 BGR로 해석되므로 PIL로 전달
+        with metrics.timed('forward_yolo'):
+            results = model(images, verbose=False)
+        outputs = []
+        for result, image in zip(results, images):
+            detections = Detections.from_result(result, image) # 일괄 처리는 시각화 생략
+            prob, label = detections.prob_label
+            outputs.append({'prob': float(prob), 'label': label, 'boxes': detections.to_boxes()})
+        return outputs
+
+def predict_batch(images, model, diagnosis_type):
+    arrays = [preprocess_for_model(image, diagnosis_type) for image in images]
+    return predict_preprocessed(arrays, model, diagnosis_type)
+
+def require_local_model(model, purpose):
+    # 모델 서버 백엔드는 predict/__call__이 없으므로 raw 출력이 필요한 경로에서 명확한 오류로 알림
+    if isinstance(model, RemoteModel):
+        raise ValueError(f'{purpose}은(는) 모델 서버 백엔드(ESC_MODEL_BACKEND=remote)에서 지원하지 않습니다')
+
+## 결과 캐시
+def _artifact_paths(diagnosis_type, backend):
+    # 백엔드가 실제로 로드하는 가중치 파일 (load_model과 같은 분기)
+    if backend in ('onnx', 'onnx-int8'):
+        import onnx_backend
+        if backend=='onnx-int8':
+            return [onnx_backend.CLASSIFIER_INT8_PATH if diagnosis_type==0 else onnx_backend.YOLO_INT8_PATH]
+        return [onnx_backend.CLASSIFIER_ONNX_PATH if diagnosis_type==0 else onnx_backend.YOLO_ONNX_PATH]
+    return [classifier_path()] if diagnosis_type==0 else [YOLO_PATH]
+
+def remote_version(diagnosis_type, url=MODEL_SERVER_URL, timeout=MODEL_SERVER_TIMEOUT):
+    # 모델 서버가 보고하는 버전 태그 (서버의 백엔드/가중치 기준, 짧게 캐시)
+    cached = _REMOTE_VERSIONS.get((url, diagnosis_type))
+    if cached and time.monotonic()-cached[1]<REMOTE_VERSION_TTL:
+        return cached[0]
+    try:
+        with urllib.request.urlopen(f'{url.rstrip("/")}/version?type={diagnosis_type}', timeout=timeout) as response:
+            version = json.loads(response.read())['version']
+    except (OSError, ValueError, KeyError):
+        return 'unknown' # 서버에 닿지 않으면 캐시하지 않음 (예측도 실패함)
+    _REMOTE_VERSIONS[(url, diagnosis_type)] = (version, time.monotonic())
+    return version
+
+def model_version(diagnosis_type, weights_version=None, cascade=None, backend=None, artifact=None):
+    # 백엔드 + 실제 로드되는 가중치 경로 + 크기 + 수정 시각 (백엔드/가중치 교체 시 캐시 무효화)
+    # weights_version: 모델 레지스트리 버전 이름, artifact: 레지스트리가 로드한 가중치 경로
+    # cascade: 결과를 낸 경로가 선별 단계를 거쳤는지 (None이면 CASCADE_ENABLED)
+    backend = backend or MODEL_BACKEND
+    if backend=='remote': # 로컬 파일이 아니라 서버가 로드한 모델 기준
+        return f'remote|{MODEL_SERVER_URL}|{remote_version(diagnosis_type)}'
+    cascade = CASCADE_ENABLED if cascade is None else cascade
+    paths = [artifact] if artifact else _artifact_paths(diagnosis_type, backend)
+    if diagnosis_type==1 and cascade: # 선별 모델/임계값도 결과에 영향
+        paths += [TRIAGE_PATH, f'threshold={CASCADE_THRESHOLD}']
+    versions = [backend] + ([weights_version] if weights_version else [])
+    for path in paths:
+        try:
+            stat = os.stat(path)
+            versions.append(f'{path}:{stat.st_size}:{int(stat.st_mtime)}')
+        except OSError:
+            versions.append(path)
+    return '|'.join(versions)
+
+def result_key(image_bytes, diagnosis_type, version=None):
+    digest = hashlib.sha256(image_bytes)
+    digest.update(f'|{diagnosis_type}|{version or model_version(diagnosis_type)}'.encode())
+    return digest.hexdigest()
+
+def _pack_result(result):
+    # [헤더 길이 4바이트][JSON 헤더][오버레이 PNG] (디스크 캐시를 pickle로 읽지 않도록 데이터만 저장)
+    prob, label = result[0], result[1]
+    overlay = b''
+    if len(result)>2 and result[2] is not None:
+        buffer = io.BytesIO()
+        result[2].save(buffer, format='PNG')
+        overlay = buffer.getvalue()
+    header = json.dumps({'prob': float(prob), 'label': label, 'has_overlay': len(result)>2}, ensure_ascii=False).encode('utf-8')
+    return struct.pack('>I', len(header)) + header + overlay
+
+def _unpack_result(payload):
+    # 형식이 맞지 않으면 ValueError (캐시 미스로 처리)
+    if len(payload)<4:
+        raise ValueError('invalid cache entry')
+    (size,) = struct.unpack('>I', payload[:4])
+    header = json.loads(payload[4:4+size].decode('utf-8'))
+    prob, label = float(header['prob']), str(header['label'])
+    if not header['has_overlay']:
+        return prob, label
+    overlay = None
+    if len(payload)>4+size:
+        overlay = Image.open(io.BytesIO(payload[4+size:]))
+        overlay.load()
+    return prob, label, overlay
+
+class ResultCache:
+    def __init__(self, max_bytes=CACHE_MAX_BYTES, cache_dir=None, disk_max_bytes=CACHE_DISK_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.cache_dir = cache_dir
+        self.disk_max_bytes = disk_max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict() # key -> 직렬화된 결과 (LRU 순서)
+        self._size = 0
+        self._disk_size = 0
+        self._lock = threading.Lock()
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+            self._disk_size = sum(size for _, _, size in self._disk_files())
+            self._prune_disk()
+
+    def _disk_path(self, key):
+        return os.path.join(self.cache_dir, f'{key}.bin')
+
+    def _disk_files(self):
+        # (수정 시각, 경로, 크기) 목록. 디스크에서 읽을 때 수정 시각을 갱신하므로 수정 시각 = 마지막 사용 시각
+        files = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.endswith('.bin'):
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, entry.path, stat.st_size))
+        return files
+
+    def _prune_disk(self):
+        # 한도를 넘으면 오래 안 쓴 파일부터 한도의 90%까지 삭제 (put마다 전체를 훑지 않도록 여유를 둠)
+        if self._disk_size<=self.disk_max_bytes:
+            return
+        files = sorted(self._disk_files())
+        self._disk_size = sum(size for _, _, size in files)
+        for _, path, size in files:
+            if self._disk_size<=self.disk_max_bytes*0.9:
+                break
+            try:
+                os.remove(path)
+                self._disk_size -= size
+            except OSError:
+                pass
+
+    def _store(self, key, payload):
+        if len(payload)>self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._size -= len(self._entries.pop(key))
+            self._entries[key] = payload
+            self._size += len(payload)
+            while self._size>self.max_bytes: # 오래된 항목부터 제거
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+
+    def get(self, key):
+        with self._lock:
+            payload = self._entries.get(key)
+            if payload is not None:
+                self._entries.move_to_end(key)
+        result = None
+        if payload is not None:
+            result = _unpack_result(payload)
+        elif self.cache_dir:
+            try:
+                with open(self._disk_path(key), 'rb') as f:
+                    payload = f.read()
+                result = _unpack_result(payload) # 손상/다른 형식의 파일은 미스
+                os.utime(self._disk_path(key)) # LRU 순서 갱신
+                self._store(key, payload)
+            except (OSError, ValueError, KeyError):
+                result = None
+
+        metrics.cache_event('result', result is not None)
+        if result is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return result
+
+    def put(self, key, result):
+        payload = _pack_result(result)
+        self._store(key, payload)
+        if self.cache_dir:
+            if len(payload)>self.disk_max_bytes:
+                return
+            tmp_path = f'{self._disk_path(key)}.{os.getpid()}.tmp'
+            try:
+                with open(tmp_path, 'wb') as f:
+                    f.write(payload)
+                os.replace(tmp_path, self._disk_path(key)) # 쓰기 도중 종료돼도 깨진 파일이 남지 않도록
+                with self._lock:
+                    self._disk_size += len(payload)
+                    self._prune_disk()
+            except OSError as e:
+                print(f'Error in ResultCache.put: {e}')
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'bytes': self._size, 'disk_bytes': self._disk_size,
+                'hits': self.hits, 'misses': self.misses}
+
+@st.cache_resource
+def load_result_cache():
+    return ResultCache(CACHE_MAX_BYTES, CACHE_DIR)
+
+def predict_image_cached(image_bytes, model, diagnosis_type, image=None, cache=None, result_store=None, version=None):
+    # 같은 업로드 + 진단 종류 + 가중치면 추론 생략 (메모리 캐시 -> 저장소 -> 추론 순)
+    # version: 결과를 낸 모델 버전 (모델 레지스트리 사용 시 model_version(diagnosis_type, 버전 이름))
+    version = version or model_version(diagnosis_type)
+    cache = cache if cache is not None else load_result_cache()
+    key = result_key(image_bytes, diagnosis_type, version)
+    result = cache.get(key)
+    if result is not None:
+        return result
+
+    result_store = result_store if result_store is not None else store.load_store()
+    image_hash = hashlib.sha256(image_bytes).hexdigest()
+    if result_store is not None:
+        stored = result_store.get_prediction(image_hash, diagnosis_type, version)
+        metrics.cache_event('store', stored is not None)
+        if stored is not None:
+            if diagnosis_type==1 and not stored['has_overlay']: # 일괄 처리 결과: 저장된 박스를 전처리 이미지에 그림 (YOLO 생략)
+                if image is None:
+                    image = Image.open(io.BytesIO(image_bytes))
+                detections = Detections.from_boxes(stored['boxes'], preprocess_image_for_yolo(image))
+                result = (stored['prob'], stored['label'], detections.render() if len(detections) else detections.image)
+            elif stored['has_overlay']:
+                result = (stored['prob'], stored['label'], stored['overlay'])
+            else:
+                result = (stored['prob'], stored['label'])
+            cache.put(key, result)
+            return result
+
+    boxes = []
+    if isinstance(model, RemoteModel): # 원본 바이트 그대로 전송
+        with metrics.timed('remote'):
+            result = model.predict_bytes(image_bytes)
+    else:
+        if image is None:
+            image = Image.open(io.BytesIO(image_bytes))
+        result = predict_image(image, model, diagnosis_type, render=False)
+        if diagnosis_type==1: # 박스는 저장소에, 시각화 이미지는 화면에
+            detections = result[2]
+            boxes = detections.to_boxes()
+            if len(detections):
+                result = (result[0], result[1], detections.render())
+            else: # 선별 단계에서 건너뛴 이미지는 전처리 이미지가 없음
+                result = (result[0], result[1], detections.image if detections.image is not None else preprocess_image_for_yolo(image))
+
+    cache.put(key, result)
+    if result_store is not None:
+        result_store.put_prediction(image_hash, diagnosis_type, version, result[0], result[1], boxes,
+            overlay=result[2] if len(result)>2 else None, has_overlay=len(result)>2)
+    return result
@@ -0,0 +1,51 @@
+import random, time
+
+
+## LLM 백엔드 인터페이스
+class LLMBackend:
+    name = 'base'
+
+    def generate(self, prompt):
+        return ''.join(self.stream(prompt))
+
+    def stream(self, prompt): # 응답 조각(str)을 도착하는 대로 반환
+        raise NotImplementedError
+
+
+class GeminiBackend(LLMBackend):
+    def __init__(self, model, name='gemini'):
+        self.model = model
+        self.name = name
+
+    def generate(self, prompt):
+        response = self.model.generate_content(prompt)
+        return response.text
+
+    def stream(self, prompt):
+        response = self.model.generate_content(prompt, stream=True)
+        for chunk in response:
+            if chunk.text:
+                yield chunk.text
+
+
+class FakeLLM(LLMBackend):
+    # 테스트/벤치마크용: 정해진 조각을 지정한 지연으로 스트리밍
+    # failure_rate / jitter로 할당량 오류와 느린 응답을 흉내냄
+    def __init__(self, chunks=None, delay=0.05, first_delay=0.2, name='fake', failure_rate=0.0, jitter=0.0, seed=0):
+        self.chunks = chunks or ['1. 주증상: ', '영상 검사 이상 소견으로 내원.\n', '2. 현재병력: ', 'AI 진단 결과 참고.\n']
+        self.delay = delay
+        self.first_delay = first_delay
+        self.name = name
+        self.failure_rate = failure_rate
+        self.jitter = jitter # 첫 응답 지연에 더해지는 최대 랜덤 지연 (초)
+        self.calls = 0
+        self._random = random.Random(seed)
+
+    def stream(self, prompt):
+        self.calls += 1
+        time.sleep(self.first_delay + self._random.uniform(0, self.jitter))
+        if self._random.random()<self.failure_rate:
+            raise RuntimeError('429 Resource has been exhausted (fake)')
+        for chunk in self.chunks:
+            time.sleep(self.delay)
+            yield chunk
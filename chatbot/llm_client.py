@@ -0,0 +1,298 @@
+import asyncio, os, queue, random, threading, time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+import metrics
+from llm_backend import LLMBackend
+
+LLM_RATE_PER_SEC = float(os.getenv('ESC_LLM_RATE', 2.0)) # 프로세스 전체 초당 요청 수
+LLM_BURST = int(os.getenv('ESC_LLM_BURST', 5))
+LLM_MAX_IN_FLIGHT = int(os.getenv('ESC_LLM_MAX_IN_FLIGHT', 4))
+LLM_TIMEOUT = float(os.getenv('ESC_LLM_TIMEOUT', 60)) # 호출 1회 제한 시간 (초)
+LLM_RETRIES = int(os.getenv('ESC_LLM_RETRIES', 3))
+LLM_BACKOFF_BASE = 0.5
+LLM_BACKOFF_MAX = 8.0
+HEDGE_MIN_SAMPLES = 20 # p95를 믿을 수 있을 만큼 쌓인 뒤에만 헤징
+
+
+## 속도 제한
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now-self.updated)*self.rate)
+                self.updated = now
+                if self.tokens>=1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1-self.tokens) / self.rate)
+
+
+## 스트리밍 호출
+class StreamCall:
+    # 백엔드 stream을 작업 스레드에서 돌리고 조각을 (호출, 종류, 값) 형태로 공용 큐에 전달
+    def __init__(self, backend, prompt, output, on_finish):
+        self.backend = backend
+        self.prompt = prompt
+        self.output = output
+        self.on_finish = on_finish
+        self.start = time.perf_counter()
+        self.finished = False
+        self._cancelled = threading.Event()
+
+    def run(self):
+        final = (self, 'done', None)
+        try:
+            for chunk in self.backend.stream(self.prompt):
+                if self._cancelled.is_set(): # 소비자가 떠났으면 남은 응답은 버림
+                    final = None
+                    break
+                self.output.put((self, 'chunk', chunk))
+        except Exception as e:
+            final = (self, 'error', e)
+        finally:
+            self.finished = True # 마지막 항목보다 먼저 (소비자가 끝난 호출을 포기한 호출로 세지 않도록)
+            self.on_finish(self)
+            if final is not None:
+                self.output.put(final)
+
+    def cancel(self):
+        self._cancelled.set()
+
+
+## LLM 클라이언트
+class LLMClient(LLMBackend):
+    # 동기 generate/stream (기존 백엔드와 같은 인터페이스) + 비동기 agenerate
+    # 모든 요청은 클라이언트 전용 이벤트 루프에서 같은 속도 제한/동시 실행 한도를 공유
+    # 동시 실행 슬롯은 제한 시간으로 포기한 호출도 작업 스레드가 실제로 끝날 때까지 유지
+    def __init__(self, primary, secondary=None, rate=LLM_RATE_PER_SEC, burst=LLM_BURST, max_in_flight=LLM_MAX_IN_FLIGHT,
+                 timeout=LLM_TIMEOUT, retries=LLM_RETRIES):
+        self.primary = primary
+        self.secondary = secondary # p95보다 늦으면 같은 요청을 보낼 예비 백엔드
+        self.name = f'client({primary.name})'
+        self.timeout = timeout
+        self.retries = retries
+        self.bucket = TokenBucket(rate, burst)
+        self.semaphore = asyncio.Semaphore(max_in_flight)
+        self.latencies = deque(maxlen=200) # 기본 백엔드 generate 지연 시간
+        self.first_chunk_latencies = deque(maxlen=200) # 기본 백엔드 stream 첫 조각 지연 시간
+        self.stats = {'calls': 0, 'retries': 0, 'hedged': 0, 'hedge_wins': 0, 'failures': 0, 'timeouts': 0,
+            'abandoned': 0, 'in_flight': 0}
+        self._executor = ThreadPoolExecutor(max_in_flight+1, thread_name_prefix='llm-call') # 슬롯보다 작업 스레드가 부족하지 않도록
+        self._loop = asyncio.new_event_loop()
+        threading.Thread(target=self._loop.run_forever, name='llm-client', daemon=True).start()
+
+    def count_tokens(self, text):
+        counter = getattr(self.primary, 'count_tokens', None)
+        if counter is None:
+            from chat_session import estimate_tokens
+            return estimate_tokens(text)
+        return counter(text)
+
+    def hedge_delay(self, samples=None):
+        samples = self.latencies if samples is None else samples
+        if self.secondary is None or len(samples)<HEDGE_MIN_SAMPLES:
+            return None
+        return float(np.percentile(samples, 95))
+
+    def _backoff(self, attempt):
+        # 지수 백오프 + full jitter (동시에 실패한 요청이 한꺼번에 재시도하지 않도록)
+        return random.uniform(0, min(LLM_BACKOFF_MAX, LLM_BACKOFF_BASE * 2**attempt))
+
+    # 슬롯 (이벤트 루프에서만 변경)
+    async def _admit(self):
+        await self.bucket.acquire()
+        await self.semaphore.acquire()
+        self.stats['in_flight'] += 1
+
+    def _release(self):
+        self.stats['in_flight'] -= 1
+        self.semaphore.release()
+
+    def _release_late_admit(self, task):
+        # 제한 시간으로 포기한 대기가 취소 직전에 슬롯을 얻었으면 바로 반환
+        if not task.cancelled() and task.exception() is None:
+            self._release()
+
+    async def _admit_within(self, timeout):
+        # 슬롯 대기에도 제한 시간 적용 (멈춘 백엔드가 슬롯을 잡고 있어도 이후 호출이 무한정 기다리지 않도록)
+        task = asyncio.ensure_future(self._admit())
+        try:
+            done, _ = await asyncio.wait({task}, timeout=max(0.0, timeout))
+        except asyncio.CancelledError:
+            task.cancel()
+            task.add_done_callback(self._release_late_admit)
+            raise
+        if not done:
+            task.cancel()
+            task.add_done_callback(self._release_late_admit)
+            self.stats['timeouts'] += 1
+            raise TimeoutError(f'LLM: no free slot within {timeout:.1f}s')
+        task.result()
+
+    def _release_future(self, future):
+        self._release()
+        if not future.cancelled():
+            future.exception() # 포기한 호출의 오류는 여기서 회수
+
+    async def _call(self, backend, prompt):
+        deadline = time.monotonic() + self.timeout # 슬롯 대기 + 호출 전체에 적용
+        await self._admit_within(self.timeout)
+        start = time.perf_counter()
+        future = self._loop.run_in_executor(self._executor, backend.generate, prompt)
+        future.add_done_callback(self._release_future)
+        try:
+            # shield: 제한 시간/헤징 취소 시에도 스레드 호출은 끝까지 진행되므로 슬롯은 그때 반환
+            result = await asyncio.wait_for(asyncio.shield(future), max(0.0, deadline-time.monotonic()))
+        except asyncio.TimeoutError:
+            self.stats['timeouts'] += 1
+            self.stats['abandoned'] += 1
+            raise
+        except asyncio.CancelledError:
+            if not future.done():
+                self.stats['abandoned'] += 1
+            raise
+        if backend is self.primary:
+            self.latencies.append(time.perf_counter()-start)
+        return result
+
+    async def _attempt(self, prompt):
+        primary = asyncio.ensure_future(self._call(self.primary, prompt))
+        delay = self.hedge_delay()
+        if delay is None:
+            return await primary
+        done, _ = await asyncio.wait({primary}, timeout=delay)
+        if done:
+            return primary.result()
+
+        # 헤징: 기본 백엔드가 p95보다 늦으면 예비 백엔드에도 요청해서 먼저 끝난 결과 사용
+        self.stats['hedged'] += 1
+        secondary = asyncio.ensure_future(self._call(self.secondary, prompt))
+        pending = {primary, secondary}
+        error = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    for other in pending:
+                        other.cancel()
+                    if task is secondary:
+                        self.stats['hedge_wins'] += 1
+                    return task.result()
+                error = task.exception()
+        raise error
+
+    async def _generate(self, prompt):
+        self.stats['calls'] += 1
+        for attempt in range(self.retries+1):
+            try:
+                with metrics.timed('llm_call'):
+                    return await self._attempt(prompt)
+            except Exception:
+                if attempt==self.retries:
+                    self.stats['failures'] += 1
+                    raise
+                self.stats['retries'] += 1
+                await asyncio.sleep(self._backoff(attempt))
+
+    async def agenerate(self, prompt):
+        # 어느 이벤트 루프에서든 await 가능
+        return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(self._generate(prompt), self._loop))
+
+    def generate(self, prompt):
+        return asyncio.run_coroutine_threadsafe(self._generate(prompt), self._loop).result()
+
+    # 스트리밍
+    def _start_stream(self, backend, prompt, output, deadline):
+        # 호출 스레드에서 첫 조각 제한 시간 안에 슬롯 대기 (넘으면 대기를 포기하고 TimeoutError)
+        asyncio.run_coroutine_threadsafe(self._admit_within(deadline-time.monotonic()), self._loop).result()
+        call = StreamCall(backend, prompt, output, lambda call: self._loop.call_soon_threadsafe(self._release))
+        self._executor.submit(call.run)
+        return call
+
+    def _first_chunk(self, prompt, calls, output, deadline):
+        # 첫 조각(또는 빈 응답 완료)까지 제한 시간 적용. 기본 백엔드가 첫 조각 p95보다 늦으면 예비 백엔드로 헤징
+        primary = calls[0]
+        delay = self.hedge_delay(self.first_chunk_latencies)
+        hedge_at = time.monotonic()+delay if delay is not None else None
+        failed = 0
+        while True:
+            wake = min(deadline, hedge_at) if hedge_at is not None else deadline
+            try:
+                item = output.get(timeout=max(0.0, wake-time.monotonic()))
+            except queue.Empty:
+                if hedge_at is not None and time.monotonic()<deadline:
+                    hedge_at = None
+                    self.stats['hedged'] += 1
+                    calls.append(self._start_stream(self.secondary, prompt, output, deadline))
+                    continue
+                self.stats['timeouts'] += 1
+                raise TimeoutError(f'LLM stream: no response within {self.timeout}s')
+            call, kind, value = item
+            if kind=='error':
+                failed += 1
+                if failed==len(calls):
+                    raise value
+                continue
+            if call is primary:
+                self.first_chunk_latencies.append(time.perf_counter()-call.start)
+            else:
+                self.stats['hedge_wins'] += 1
+            return call, item
+
+    def _next(self, output, call):
+        # 이후 조각은 조각 사이 간격에 같은 제한 시간 적용 (헤징에서 진 호출의 조각은 무시)
+        deadline = time.monotonic() + self.timeout
+        while True:
+            try:
+                item = output.get(timeout=max(0.0, deadline-time.monotonic()))
+            except queue.Empty:
+                self.stats['timeouts'] += 1
+                raise TimeoutError(f'LLM stream: stalled for {self.timeout}s')
+            if item[0] is call:
+                return item
+
+    def _abandon(self, calls):
+        for call in calls:
+            if not call.finished:
+                self.stats['abandoned'] += 1
+            call.cancel()
+
+    def stream(self, prompt):
+        # 스트리밍은 첫 조각이 오기 전까지만 재시도 (이미 출력한 내용은 되돌릴 수 없음)
+        self.stats['calls'] += 1
+        for attempt in range(self.retries+1):
+            output = queue.Queue()
+            deadline = time.monotonic() + self.timeout # 슬롯 대기 + 첫 조각까지
+            calls = []
+            try:
+                calls.append(self._start_stream(self.primary, prompt, output, deadline))
+                winner, item = self._first_chunk(prompt, calls, output, deadline)
+                break
+            except Exception:
+                self._abandon(calls)
+                if attempt==self.retries:
+                    self.stats['failures'] += 1
+                    raise
+                self.stats['retries'] += 1
+                time.sleep(self._backoff(attempt))
+        self._abandon([call for call in calls if call is not winner])
+
+        try:
+            while item[1]=='chunk':
+                yield item[2]
+                item = self._next(output, winner)
+            if item[1]=='error':
+                raise item[2]
+        finally:
+            self._abandon([winner]) # 소비자가 중간에 멈춘 경우 (끝난 호출이면 아무것도 하지 않음)
@@ -0,0 +1,209 @@
+import argparse, io, json, os, random, threading, time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import image_model as im
+import assistant_mega as am
+from benchmark import SAMPLE_FORM
+from llm_backend import FakeLLM
+from llm_client import LLMClient
+from stub_models import load_stub_model, synthetic_image
+
+try:
+    import resource # 리눅스/맥 전용
+except ImportError:
+    resource = None
+
+LEVELS = (1, 2, 4, 8, 16) # 동시 세션 수
+STAGES = ('decode', 'predict', 'record', 'request')
+SATURATION_GAIN = 1.1 # 세션 수를 늘려도 처리량이 이 비율 이상 늘지 않으면 포화
+UPLOAD_VARIANTS = 4 # 진단 종류별 미리 만들어 두는 업로드 이미지 수
+
+_WORKER = {} # 워커 프로세스마다 한 번 로드하는 모델/LLM/업로드 이미지
+
+
+## 워커 (Streamlit 서버 프로세스 1개에 해당)
+def _init_worker(config):
+    random.seed(os.getpid())
+    models = {}
+    for diagnosis_type in (0, 1):
+        models[diagnosis_type] = im.load_model(diagnosis_type) if config['real_models'] else \
+            load_stub_model(diagnosis_type, config['model_latency'])
+    if config['real_llm']:
+        llm = am.load_gemini()
+    else:
+        llm = FakeLLM(delay=config['llm_delay'], first_delay=config['llm_first_delay'], seed=os.getpid())
+        if config['llm_rate']>0: # 실제 서비스처럼 속도 제한 클라이언트를 거침
+            llm = LLMClient(llm, rate=config['llm_rate'])
+    uploads = {}
+    for diagnosis_type in (0, 1):
+        uploads[diagnosis_type] = []
+        for seed in range(UPLOAD_VARIANTS):
+            buffer = io.BytesIO()
+            synthetic_image(diagnosis_type, config['size'], seed=seed).save(buffer, format='PNG')
+            uploads[diagnosis_type].append(buffer.getvalue())
+    _WORKER.update(config=config, models=models, llm=llm, uploads=uploads)
+
+def _rss_mb():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2**20
+    except (OSError, ValueError, AttributeError):
+        return None
+
+def _peak_rss_mb():
+    if resource is None:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024 # 리눅스: KB 단위
+
+class StageError(Exception):
+    def __init__(self, stage, error):
+        super().__init__(f'{stage}: {error}')
+        self.stage = stage
+        self.reason = f'{type(error).__name__}: {error}'[:200] if isinstance(error, Exception) else str(error)[:200]
+
+def _request(diagnosis_type, samples):
+    # main_page 한 번의 진단 흐름: 업로드 디코드 -> 추론 -> 초진기록지 생성
+    config, models, llm = _WORKER['config'], _WORKER['models'], _WORKER['llm']
+    stage = 'decode'
+    try:
+        start = time.perf_counter()
+        image = im.decode_image(random.choice(_WORKER['uploads'][diagnosis_type]))
+        decoded = time.perf_counter()
+        stage = 'predict'
+        result = im.predict_image(image, models[diagnosis_type], diagnosis_type)
+        predicted = time.perf_counter()
+        stage = 'record'
+        record = am.generate_medical_record(llm, SAMPLE_FORM, diagnosis_type, result[0], result[1])
+        done = time.perf_counter()
+    except Exception as e:
+        raise StageError(stage, e) from e
+    if record.startswith(am.RECORD_ERROR_PREFIX): # generate_medical_record는 오류를 문자열로 반환
+        raise StageError('record', record[len(am.RECORD_ERROR_PREFIX):].lstrip(': '))
+    samples['decode'].append(decoded-start)
+    samples['predict'].append(predicted-decoded)
+    samples['record'].append(done-predicted)
+    samples['request'].append(done-start)
+
+def _session(deadline, samples, errors):
+    config = _WORKER['config']
+    think = config['think_time']
+    time.sleep(random.uniform(0, think)) # 세션들이 동시에 시작하지 않도록
+    while time.perf_counter()<deadline:
+        diagnosis_type = 0 if random.random()<config['thyroid_ratio'] else 1
+        try:
+            _request(diagnosis_type, samples)
+        except StageError as e:
+            errors.append({'stage': e.stage, 'diagnosis_type': diagnosis_type, 'error': e.reason})
+        remaining = deadline-time.perf_counter()
+        if think>0 and remaining>0: # 평균 think_time인 지수분포 (검토/입력하는 시간)
+            time.sleep(min(random.expovariate(1/think), remaining))
+
+def run_worker(sessions, duration):
+    samples = {stage: [] for stage in STAGES}
+    errors = []
+    rss_before = _rss_mb()
+    deadline = time.perf_counter()+duration
+    threads = [threading.Thread(target=_session, args=(deadline, samples, errors), daemon=True) for _ in range(sessions)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return {'pid': os.getpid(), 'sessions': sessions, 'samples': samples, 'errors': errors,
+        'rss_mb': _rss_mb(), 'rss_before_mb': rss_before, 'peak_rss_mb': _peak_rss_mb()}
+
+
+## 부하 단계별 실행
+def _split(sessions, workers):
+    return [sessions//workers + (1 if i<sessions%workers else 0) for i in range(workers)]
+
+def _percentiles(values):
+    if not values:
+        return {'p50_ms': None, 'p95_ms': None, 'p99_ms': None}
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {'p50_ms': round(float(p50)*1000, 2), 'p95_ms': round(float(p95)*1000, 2), 'p99_ms': round(float(p99)*1000, 2)}
+
+def _summarize_level(sessions, duration, worker_results):
+    samples = {stage: [] for stage in STAGES}
+    for result in worker_results:
+        for stage in STAGES:
+            samples[stage].extend(result['samples'][stage])
+    requests = len(samples['request'])
+    reasons = {} # (단계, 진단 종류, 오류) -> 횟수
+    for result in worker_results:
+        for error in result['errors']:
+            key = (error['stage'], error['diagnosis_type'], error['error'])
+            reasons[key] = reasons.get(key, 0) + 1
+    memory = {}
+    for result in worker_results: # 같은 프로세스가 여러 작업을 받았으면 마지막 값
+        memory[result['pid']] = {'rss_mb': result['rss_mb'] and round(result['rss_mb'], 1),
+            'peak_rss_mb': result['peak_rss_mb'] and round(result['peak_rss_mb'], 1)}
+    return {
+        'sessions': sessions,
+        'requests': requests,
+        'errors': sum(reasons.values()),
+        'error_reasons': [{'stage': stage, 'diagnosis_type': diagnosis_type, 'error': error, 'count': count}
+            for (stage, diagnosis_type, error), count in sorted(reasons.items(), key=lambda item: -item[1])],
+        'throughput_rps': round(requests/duration, 3),
+        'stages': {stage: {'count': len(samples[stage]), **_percentiles(samples[stage])} for stage in STAGES},
+        'memory': memory,
+    }
+
+def find_saturation(levels):
+    # 세션 수를 늘려도 처리량이 SATURATION_GAIN배 이상 늘지 않는 첫 지점과 그때의 p99 증가율
+    for previous, current in zip(levels, levels[1:]):
+        if current['throughput_rps']<previous['throughput_rps']*SATURATION_GAIN:
+            before, after = previous['stages']['request']['p99_ms'], current['stages']['request']['p99_ms']
+            return {'sessions': previous['sessions'], 'throughput_rps': previous['throughput_rps'],
+                'next_sessions': current['sessions'], 'p99_growth': round(after/before, 2) if before and after else None}
+    return None
+
+def run(levels=LEVELS, workers=1, duration=10.0, think_time=1.0, thyroid_ratio=0.5, size=(1024, 768),
+        real_models=False, real_llm=False, model_latency=0.0, llm_delay=0.02, llm_first_delay=0.5, llm_rate=0.0):
+    config = {'think_time': think_time, 'thyroid_ratio': thyroid_ratio, 'size': size, 'real_models': real_models,
+        'real_llm': real_llm, 'model_latency': model_latency, 'llm_delay': llm_delay,
+        'llm_first_delay': llm_first_delay, 'llm_rate': llm_rate}
+    results = []
+    if workers<=0: # 디버깅용: 현재 프로세스에서 스레드로만 실행
+        _init_worker(config)
+        for sessions in levels:
+            results.append(_summarize_level(sessions, duration, [run_worker(sessions, duration)]))
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(config,)) as pool:
+            for sessions in levels:
+                futures = [pool.submit(run_worker, count, duration) for count in _split(sessions, workers) if count]
+                results.append(_summarize_level(sessions, duration, [future.result() for future in futures]))
+                print(f"{sessions} sessions: {results[-1]['throughput_rps']} req/s, "
+                    f"p99 {results[-1]['stages']['request']['p99_ms']} ms", flush=True)
+    return {'config': {**config, 'workers': workers, 'duration': duration}, 'levels': results,
+        'saturation': find_saturation(results)}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='동시 세션 부하 테스트 (업로드 -> 추론 -> 초진기록지)')
+    parser.add_argument('--levels', type=int, nargs='+', default=list(LEVELS), help='차례로 실행할 동시 세션 수')
+    parser.add_argument('--workers', type=int, default=1, help='서버 프로세스 수 (0: 현재 프로세스)')
+    parser.add_argument('--duration', type=float, default=10.0, help='단계별 실행 시간 (초)')
+    parser.add_argument('--think-time', type=float, default=1.0, help='요청 사이 평균 대기 시간 (초)')
+    parser.add_argument('--thyroid-ratio', type=float, default=0.5, help='갑상선 초음파 업로드 비율 (나머지는 뇌 MRI)')
+    parser.add_argument('--size', default='1024x768', help='업로드 이미지 크기')
+    parser.add_argument('--real-models', action='store_true', help='대체 모델 대신 실제 가중치 사용')
+    parser.add_argument('--real-llm', action='store_true', help='가짜 LLM 대신 Gemini 사용 (요금 발생)')
+    parser.add_argument('--model-latency', type=float, default=0.0, help='대체 모델의 이미지당 추가 지연 (초)')
+    parser.add_argument('--llm-first-delay', type=float, default=0.5, help='가짜 LLM 첫 응답 지연 (초)')
+    parser.add_argument('--llm-rate', type=float, default=0.0, help='0보다 크면 가짜 LLM을 이 속도 제한의 LLMClient로 감쌈')
+    parser.add_argument('--output', help='결과 JSON 파일')
+    args = parser.parse_args(argv)
+
+    size = tuple(int(v) for v in args.size.split('x'))
+    report = run(args.levels, args.workers, args.duration, args.think_time, args.thyroid_ratio, size,
+        args.real_models, args.real_llm, args.model_latency, llm_first_delay=args.llm_first_delay, llm_rate=args.llm_rate)
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text)
+    else:
+        print(text)
+
+if __name__=='__main__':
+    main()
@@ -3,8 +3,6 @@ from dotenv import load_dotenv
 from PIL import Image
 
 import streamlit as st
-import tensorflow as tf
-import google.generativeai as genai
 # import google import genai
 
 import image_model as im
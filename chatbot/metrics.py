@@ -0,0 +1,139 @@
+import os, threading, time
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0) # 초
+WINDOW = 2048 # 백분위 계산에 쓰는 최근 샘플 수
+METRICS_FILE = os.getenv('ESC_METRICS_FILE') # 지정 시 Prometheus 텍스트 파일로 기록
+METRICS_PORT = int(os.getenv('ESC_METRICS_PORT', 0)) # 0이 아니면 /metrics 엔드포인트 실행
+
+
+## 단계별 지연 시간 / 오류 / 캐시 적중률
+class StageStats:
+    def __init__(self):
+        self.bucket_counts = [0] * len(BUCKETS)
+        self.count = 0
+        self.total = 0.0
+        self.errors = 0
+        self.recent = deque(maxlen=WINDOW)
+
+    def observe(self, seconds):
+        self.count += 1
+        self.total += seconds
+        self.recent.append(seconds)
+        for i, bound in enumerate(BUCKETS):
+            if seconds<=bound:
+                self.bucket_counts[i] += 1
+
+    def percentiles(self):
+        if not self.recent:
+            return {'p50': None, 'p95': None, 'p99': None}
+        values = np.percentile(np.fromiter(self.recent, dtype=float), [50, 95, 99])
+        return {f'p{q}': round(float(v), 4) for q, v in zip((50, 95, 99), values)}
+
+class MetricsRegistry:
+    def __init__(self):
+        self.stages = {}
+        self.cache = {} # 캐시 이름 -> [적중, 미적중]
+        self._lock = threading.Lock()
+
+    def _stage(self, stage):
+        if stage not in self.stages:
+            self.stages[stage] = StageStats()
+        return self.stages[stage]
+
+    def observe(self, stage, seconds):
+        with self._lock:
+            self._stage(stage).observe(seconds)
+
+    def error(self, stage):
+        with self._lock:
+            self._stage(stage).errors += 1
+
+    def cache_event(self, cache, hit):
+        with self._lock:
+            counts = self.cache.setdefault(cache, [0, 0])
+            counts[0 if hit else 1] += 1
+
+    @contextmanager
+    def timed(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        except BaseException:
+            self.error(stage)
+            raise
+        finally:
+            self.observe(stage, time.perf_counter()-start)
+
+    def summary(self):
+        with self._lock:
+            stages = {
+                stage: {'count': stats.count, 'errors': stats.errors, **stats.percentiles()}
+                for stage, stats in sorted(self.stages.items())
+            }
+            caches = {
+                cache: {'hits': hits, 'misses': misses, 'hit_rate': round(hits/(hits+misses), 4) if hits+misses else None}
+                for cache, (hits, misses) in sorted(self.cache.items())
+            }
+        return {'stages': stages, 'caches': caches}
+
+    def render_prometheus(self):
+        lines = [
+            '# HELP esc_stage_seconds Diagnosis pipeline stage latency.',
+            '# TYPE esc_stage_seconds histogram',
+        ]
+        with self._lock:
+            for stage, stats in sorted(self.stages.items()):
+                for bound, count in zip(BUCKETS, stats.bucket_counts):
+                    lines.append(f'esc_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {count}')
+                lines.append(f'esc_stage_seconds_bucket{{stage="{stage}",le="+Inf"}} {stats.count}')
+                lines.append(f'esc_stage_seconds_sum{{stage="{stage}"}} {stats.total:.6f}')
+                lines.append(f'esc_stage_seconds_count{{stage="{stage}"}} {stats.count}')
+            lines += ['# HELP esc_stage_errors_total Diagnosis pipeline stage errors.', '# TYPE esc_stage_errors_total counter']
+            for stage, stats in sorted(self.stages.items()):
+                lines.append(f'esc_stage_errors_total{{stage="{stage}"}} {stats.errors}')
+            lines += ['# HELP esc_cache_requests_total Cache lookups by result.', '# TYPE esc_cache_requests_total counter']
+            for cache, (hits, misses) in sorted(self.cache.items()):
+                lines.append(f'esc_cache_requests_total{{cache="{cache}",result="hit"}} {hits}')
+                lines.append(f'esc_cache_requests_total{{cache="{cache}",result="miss"}} {misses}')
+        return '\n'.join(lines) + '\n'
+
+    def write_file(self, path=None):
+        path = path or METRICS_FILE
+        if not path:
+            return
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write(self.render_prometheus())
+        os.replace(tmp_path, path)
+
+REGISTRY = MetricsRegistry() # 프로세스 전역
+timed = REGISTRY.timed
+observe = REGISTRY.observe
+cache_event = REGISTRY.cache_event
+
+
+## 내보내기
+def start_metrics_server(port=METRICS_PORT, host='127.0.0.1'):
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path!='/metrics':
+                self.send_error(404)
+                return
+            body = REGISTRY.render_prometheus().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, name='metrics-server', daemon=True).start()
+    return server
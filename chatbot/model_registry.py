@@ -0,0 +1,259 @@
+import argparse, json, os, threading, time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from PIL import Image
+import streamlit as st
+
+import image_model as im
+
+REGISTRY_DIR = os.getenv('ESC_MODEL_REGISTRY', 'model/registry') # 버전별 가중치 + manifest.json
+REGISTRY_POLL_SECONDS = float(os.getenv('ESC_MODEL_REGISTRY_POLL', 10)) # manifest 변경 확인 간격
+MANIFEST_NAME = 'manifest.json'
+WARMUP_SIZE = (512, 512)
+
+# manifest.json 예시 (경로는 레지스트리 디렉터리 기준)
+# {"0": {"active": "250218_ep30", "versions": {"250218_ep30": "250218_base-model_ep-30.keras"}},
+#  "1": {"active": "250319_yolov8_ep100", "versions": {"250319_yolov8_ep100": "250319_yolov8_ep100/weights/best.pt"}}}
+
+
+## 버전별 모델 로드
+def load_artifact(diagnosis_type, path):
+    # 확장자로 런타임 선택: .keras/.h5 -> Keras, .pt -> ultralytics, .onnx -> ONNX Runtime
+    if path.endswith('.onnx'):
+        import onnx_backend
+        if diagnosis_type==0:
+            return onnx_backend.OnnxClassifier(path, onnx_backend.ONNX_THREADS)
+        return onnx_backend.OnnxDetector(path, onnx_backend.ONNX_THREADS)
+    if diagnosis_type==0:
+        return im.CompiledClassifier(im._build_classifier(path))
+    return im._build_detector(path)
+
+def warm_up(model, diagnosis_type):
+    # 빈 이미지로 한 번 추론 (첫 요청이 그래프 생성/메모리 할당 비용을 내지 않도록)
+    im.predict_image(Image.new('RGB', WARMUP_SIZE), model, diagnosis_type, render=False)
+
+class ModelHandle:
+    def __init__(self, diagnosis_type, version, model, path=None):
+        self.diagnosis_type = diagnosis_type
+        self.version = version
+        self.model = model
+        backend = 'onnx' if path and path.endswith('.onnx') else 'native' # load_artifact와 같은 확장자 기준
+        self.tag = im.model_version(diagnosis_type, version, backend=backend, artifact=path) # 결과 캐시/저장소에 기록되는 버전
+        self.in_flight = 0
+
+
+## 레지스트리
+class ModelRegistry:
+    def __init__(self, root=REGISTRY_DIR, loader=load_artifact, warmup=warm_up):
+        self.root = root
+        self.loader = loader
+        self.warmup = warmup
+        self._active = {} # 진단 종류 -> ModelHandle
+        self._retiring = [] # 교체됐지만 아직 처리 중인 요청이 있는 이전 버전
+        self._loading = {} # 진단 종류 -> (버전, Future)
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='model-registry') # 한 번에 한 모델씩 로드
+        self._manifest_mtime = None
+
+    @property
+    def manifest_path(self):
+        return os.path.join(self.root, MANIFEST_NAME)
+
+    def manifest(self):
+        with open(self.manifest_path, encoding='utf-8') as f:
+            return json.load(f)
+
+    def _load(self, diagnosis_type, version):
+        entry = self.manifest()[str(diagnosis_type)]
+        if version not in entry['versions']:
+            raise KeyError(f'unknown model version {version!r} for type {diagnosis_type}')
+        start = time.perf_counter()
+        path = os.path.join(self.root, entry['versions'][version])
+        model = self.loader(diagnosis_type, path)
+        self.warmup(model, diagnosis_type)
+        im.STARTUP_TIMES[f'load:registry-{diagnosis_type}-{version}'] = round(time.perf_counter()-start, 3)
+        return ModelHandle(diagnosis_type, version, model, path)
+
+    def _swap(self, handle):
+        # 새 요청부터 새 버전 사용. 처리 중인 요청은 잡고 있는 이전 핸들로 끝까지 실행
+        with self._lock:
+            previous = self._active.get(handle.diagnosis_type)
+            self._active[handle.diagnosis_type] = handle
+            if previous is not None and previous.in_flight>0:
+                self._retiring.append(previous)
+        return previous
+
+    def activate(self, diagnosis_type, version):
+        # 현재 스레드에서 로드 + 워밍업 후 교체
+        handle = self._load(diagnosis_type, version)
+        self._swap(handle)
+        return handle
+
+    def _activate_background(self, diagnosis_type, version):
+        try:
+            return self.activate(diagnosis_type, version)
+        finally:
+            with self._lock:
+                self._loading.pop(diagnosis_type, None)
+
+    def reload_async(self, diagnosis_type, version=None):
+        # version=None이면 manifest의 active 버전. 이미 같은 버전을 로드 중이면 그 작업을 반환
+        version = version or self.manifest()[str(diagnosis_type)]['active']
+        with self._lock:
+            current = self._active.get(diagnosis_type)
+            if current is not None and current.version==version:
+                return None
+            loading = self._loading.get(diagnosis_type)
+            if loading is not None and loading[0]==version:
+                return loading[1]
+            future = self._executor.submit(self._activate_background, diagnosis_type, version)
+            self._loading[diagnosis_type] = (version, future)
+        return future
+
+    def serves(self, diagnosis_type):
+        # manifest에 항목이 있는 진단 종류만 레지스트리에서 제공 (manifest를 못 읽으면 이미 로드한 종류는 계속 제공)
+        try:
+            return str(diagnosis_type) in self.manifest()
+        except (OSError, ValueError):
+            with self._lock:
+                return diagnosis_type in self._active
+
+    def handle(self, diagnosis_type):
+        with self._lock:
+            handle = self._active.get(diagnosis_type)
+        if handle is None: # 첫 요청: 로드가 끝날 때까지 대기
+            future = self.reload_async(diagnosis_type)
+            if future is not None:
+                future.result()
+            with self._lock:
+                handle = self._active[diagnosis_type]
+        return handle
+
+    @contextmanager
+    def use(self, diagnosis_type):
+        handle = self.handle(diagnosis_type)
+        with self._lock:
+            handle.in_flight += 1
+        try:
+            yield handle
+        finally:
+            with self._lock:
+                handle.in_flight -= 1
+                self._retiring = [h for h in self._retiring if h.in_flight>0] # 요청이 끝난 이전 버전은 해제
+
+    def check_manifest(self):
+        # manifest가 바뀌었으면 이미 사용 중인 진단 종류의 active 버전을 백그라운드 로드
+        try:
+            mtime = os.stat(self.manifest_path).st_mtime
+        except OSError:
+            return
+        if mtime==self._manifest_mtime:
+            return
+        self._manifest_mtime = mtime
+        with self._lock:
+            diagnosis_types = list(self._active)
+        for diagnosis_type in diagnosis_types:
+            try:
+                self.reload_async(diagnosis_type)
+            except (KeyError, ValueError) as e: # 잘못된 manifest: 현재 버전 유지
+                print(f'model registry: {e}')
+
+    def watch(self, interval=REGISTRY_POLL_SECONDS):
+        def loop():
+            while True:
+                time.sleep(interval)
+                self.check_manifest()
+        threading.Thread(target=loop, name='model-registry-watch', daemon=True).start()
+
+    def status(self):
+        with self._lock:
+            return {
+                str(diagnosis_type): {
+                    'active': handle.version,
+                    'in_flight': handle.in_flight,
+                    'loading': self._loading[diagnosis_type][0] if diagnosis_type in self._loading else None,
+                    'retiring': [h.version for h in self._retiring if h.diagnosis_type==diagnosis_type],
+                }
+                for diagnosis_type, handle in sorted(self._active.items())
+            }
+
+@st.cache_resource
+def load_registry():
+    # manifest가 없으면 None (기존 MODEL_PATH/YOLO_PATH 사용)
+    registry = ModelRegistry()
+    if not os.path.exists(registry.manifest_path):
+        return None
+    registry.check_manifest()
+    registry.watch()
+    return registry
+
+def registry_for(diagnosis_type):
+    # 모델 선택 우선순위: ESC_MODEL_BACKEND=remote(모델 서버) > manifest 항목 > load_model(ESC_MODEL_BACKEND)
+    # 레지스트리 버전의 런타임은 가중치 확장자로 정해짐 (ONNX로 서빙하려면 .onnx 버전을 등록)
+    if im.MODEL_BACKEND=='remote':
+        return None
+    registry = load_registry()
+    if registry is None or not registry.serves(diagnosis_type):
+        return None
+    return registry
+
+@contextmanager
+def serving_model(diagnosis_type):
+    # (모델, 결과에 기록할 버전). 레지스트리를 쓰지 않는 진단 종류는 load_model 사용
+    registry = registry_for(diagnosis_type)
+    if registry is None:
+        yield im.load_model(diagnosis_type), im.model_version(diagnosis_type)
+        return
+    with registry.use(diagnosis_type) as handle:
+        yield handle.model, handle.tag
+
+
+## manifest 편집 (실행 중인 앱은 REGISTRY_POLL_SECONDS 안에 새 버전으로 교체)
+def write_manifest(root, manifest):
+    path = os.path.join(root, MANIFEST_NAME)
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path) # 읽는 쪽이 쓰다 만 파일을 보지 않도록
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='버전별 모델 레지스트리 관리')
+    parser.add_argument('--root', default=REGISTRY_DIR)
+    commands = parser.add_subparsers(dest='command', required=True)
+    register = commands.add_parser('register', help='버전 추가')
+    register.add_argument('type', type=int, choices=[0, 1])
+    register.add_argument('version')
+    register.add_argument('path', help='레지스트리 디렉터리 기준 가중치 경로')
+    register.add_argument('--activate', action='store_true')
+    activate = commands.add_parser('activate', help='서비스할 버전 변경 (롤백 포함)')
+    activate.add_argument('type', type=int, choices=[0, 1])
+    activate.add_argument('version')
+    commands.add_parser('show', help='manifest 출력')
+    args = parser.parse_args(argv)
+
+    path = os.path.join(args.root, MANIFEST_NAME)
+    manifest = {}
+    if os.path.exists(path):
+        with open(path, encoding='utf-8') as f:
+            manifest = json.load(f)
+
+    if args.command=='register':
+        if not os.path.exists(os.path.join(args.root, args.path)):
+            parser.error(f'{args.path} not found under {args.root}')
+        entry = manifest.setdefault(str(args.type), {'active': None, 'versions': {}})
+        entry['versions'][args.version] = args.path
+        if args.activate or entry['active'] is None:
+            entry['active'] = args.version
+        os.makedirs(args.root, exist_ok=True)
+        write_manifest(args.root, manifest)
+    elif args.command=='activate':
+        entry = manifest.get(str(args.type))
+        if entry is None or args.version not in entry['versions']:
+            parser.error(f'unknown version {args.version!r}')
+        entry['active'] = args.version
+        write_manifest(args.root, manifest)
+    print(json.dumps(manifest, ensure_ascii=False, indent=2))
+
+if __name__=='__main__':
+    main()
@@ -0,0 +1,127 @@
+import argparse, base64, io, json, queue, threading, time
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import image_model as im
+
+MAX_BATCH = 16
+MAX_WAIT_MS = 10 # 첫 요청 이후 배치를 모으는 최대 대기 시간
+
+
+## 마이크로 배치
+class MicroBatcher:
+    def __init__(self, model, diagnosis_type, max_batch=MAX_BATCH, max_wait_ms=MAX_WAIT_MS):
+        self.model = model
+        self.diagnosis_type = diagnosis_type
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self.batch_sizes = [] # 최근 배치 크기 (모니터링용)
+        self._queue = queue.Queue()
+        threading.Thread(target=self._run, name=f'batcher-{diagnosis_type}', daemon=True).start()
+
+    def submit(self, image):
+        future = Future()
+        self._queue.put((image, future))
+        return future
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch)<self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining<=0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            images = [image for image, _ in batch]
+            try:
+                results = im.predict_image_batch(images, self.model, self.diagnosis_type)
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            self.batch_sizes = (self.batch_sizes + [len(batch)])[-100:]
+            for (_, future), result in zip(batch, results):
+                future.set_result(result)
+
+
+## HTTP
+def _encode_result(result):
+    payload = {'prob': float(result[0]), 'label': result[1], 'has_overlay': len(result)>2, 'overlay': None}
+    if len(result)>2 and result[2] is not None:
+        buffer = io.BytesIO()
+        result[2].save(buffer, format='PNG')
+        payload['overlay'] = base64.b64encode(buffer.getvalue()).decode('ascii')
+    return payload
+
+def make_handler(batchers, timeout, versions):
+    class Handler(BaseHTTPRequestHandler):
+        def _send(self, status, payload):
+            body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            if url.path=='/health':
+                self._send(200, {'status': 'ok', 'batch_sizes': {k: b.batch_sizes[-10:] for k, b in batchers.items()}})
+            elif url.path=='/version': # 클라이언트 결과 캐시/저장소 태그 (서버가 로드한 백엔드/가중치 기준)
+                try:
+                    self._send(200, {'version': versions[int(parse_qs(url.query).get('type', ['0'])[0])]})
+                except (KeyError, ValueError):
+                    self._send(404, {'error': 'unknown diagnosis type'})
+            else:
+                self._send(404, {'error': 'not found'})
+
+        def do_POST(self):
+            url = urlparse(self.path)
+            if url.path!='/predict':
+                self._send(404, {'error': 'not found'})
+                return
+            try:
+                diagnosis_type = int(parse_qs(url.query).get('type', ['0'])[0])
+                data = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                image = im.decode_image(data) # 앱과 같은 바이트/픽셀 한도 + 작업 해상도 축소
+                result = batchers[diagnosis_type].submit(image).result(timeout=timeout)
+                self._send(200, _encode_result(result))
+            except Exception as e:
+                self._send(500, {'error': str(e)})
+
+        def log_message(self, format, *args): # 요청마다 로그 출력하지 않음
+            pass
+
+    return Handler
+
+def serve(host='127.0.0.1', port=8765, backend='native', diagnosis_types=(0, 1),
+          max_batch=MAX_BATCH, max_wait_ms=MAX_WAIT_MS, timeout=60):
+    batchers = {
+        diagnosis_type: MicroBatcher(im.load_model(diagnosis_type, backend=backend), diagnosis_type, max_batch, max_wait_ms)
+        for diagnosis_type in diagnosis_types
+    }
+    versions = {diagnosis_type: im.model_version(diagnosis_type, backend=backend) for diagnosis_type in diagnosis_types}
+    server = ThreadingHTTPServer((host, port), make_handler(batchers, timeout, versions))
+    print(f'model server listening on http://{host}:{port} ({backend}, types={list(diagnosis_types)})')
+    server.serve_forever()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='세션/프로세스 간 공유 모델 서버 (마이크로 배치)')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--backend', default='native', choices=['native', 'onnx', 'onnx-int8'])
+    parser.add_argument('--types', type=int, nargs='+', default=[0, 1], choices=[0, 1])
+    parser.add_argument('--max-batch', type=int, default=MAX_BATCH)
+    parser.add_argument('--max-wait-ms', type=float, default=MAX_WAIT_MS)
+    args = parser.parse_args(argv)
+
+    serve(args.host, args.port, args.backend, args.types, args.max_batch, args.max_wait_ms)
+
+if __name__=='__main__':
+    main()
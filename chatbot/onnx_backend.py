@@ -0,0 +1,206 @@
+import argparse, ast, json, os, sys, time
+
+import cv2
+import numpy as np
+from PIL import Image
+
+import image_model as im
+
+CLASSIFIER_ONNX_PATH = 'model/250218_base-model_ep-30.onnx'
+YOLO_ONNX_PATH = os.path.splitext(im.YOLO_PATH)[0] + '.onnx'
+CLASSIFIER_INT8_PATH = 'model/250218_base-model_ep-30.int8.onnx' # quantize.py로 생성
+YOLO_INT8_PATH = os.path.splitext(im.YOLO_PATH)[0] + '.int8.onnx'
+
+ONNX_THREADS = int(os.getenv('ESC_ONNX_THREADS', 0)) # 0: ONNX Runtime 기본값 (물리 코어 수)
+DETECTOR_IMGSZ = 640 # ultralytics 기본 추론 크기 (512 입력을 640으로 키워 추론)
+DETECTOR_CONF = 0.25
+DETECTOR_IOU = 0.7
+
+# 패리티 허용 오차: 확률(%) 차이, 라벨 일치, 박스 IoU
+PROB_TOLERANCE = 0.5
+BOX_IOU_TOLERANCE = 0.9
+
+
+## 내보내기
+def export_classifier(output_path=CLASSIFIER_ONNX_PATH):
+    tf = im.lazy_import('tensorflow')
+    tf2onnx = im.lazy_import('tf2onnx')
+
+    model = im.load_model(0, backend='native').model # CompiledClassifier 안의 Keras 모델
+    signature = [tf.TensorSpec((None, 180, 180, 3), tf.float32, name='input')]
+    tf2onnx.convert.from_keras(model, input_signature=signature, opset=13, output_path=output_path)
+    return output_path
+
+def export_detector(output_path=YOLO_ONNX_PATH):
+    ultralytics = im.lazy_import('ultralytics')
+
+    exported = ultralytics.YOLO(im.YOLO_PATH).export(format='onnx', imgsz=DETECTOR_IMGSZ, dynamic=True)
+    if os.path.abspath(exported)!=os.path.abspath(output_path):
+        os.replace(exported, output_path)
+    return output_path
+
+
+## 런타임
+def create_session(path, threads=ONNX_THREADS):
+    ort = im.lazy_import('onnxruntime')
+
+    options = ort.SessionOptions()
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    if threads>0:
+        options.intra_op_num_threads = threads
+    return ort.InferenceSession(path, sess_options=options, providers=['CPUExecutionProvider'])
+
+class OnnxClassifier:
+    # Keras model.predict와 같은 방식으로 호출
+    def __init__(self, path=CLASSIFIER_ONNX_PATH, threads=ONNX_THREADS):
+        self.session = create_session(path, threads)
+        self.input_name = self.session.get_inputs()[0].name
+
+    def predict(self, inputs, batch_size=None, verbose=0):
+        batch = np.asarray(inputs, dtype=np.float32)
+        return self.session.run(None, {self.input_name: batch})[0]
+
+class OnnxBoxes:
+    def __init__(self, xyxy, conf, cls):
+        self.xyxy = xyxy
+        self.conf = conf
+        self.cls = cls
+
+    def __len__(self):
+        return len(self.conf)
+
+class OnnxResult:
+    def __init__(self, image, boxes, names):
+        self.orig_img = image # RGB
+        self.boxes = boxes
+        self.names = names
+
+    def plot(self):
+        # ultralytics Results.plot처럼 BGR 배열 반환
+        canvas = cv2.cvtColor(self.orig_img, cv2.COLOR_RGB2BGR)
+        return im.draw_boxes(canvas, self.boxes.xyxy, self.boxes.conf, self.boxes.cls, self.names)
+
+def nms(boxes, scores, iou_threshold):
+    order = scores.argsort()[::-1]
+    areas = (boxes[:, 2]-boxes[:, 0]) * (boxes[:, 3]-boxes[:, 1])
+    keep = []
+    while len(order)>0:
+        i = order[0]
+        keep.append(i)
+        xx1 = np.maximum(boxes[i, 0], boxes[order[1:], 0])
+        yy1 = np.maximum(boxes[i, 1], boxes[order[1:], 1])
+        xx2 = np.minimum(boxes[i, 2], boxes[order[1:], 2])
+        yy2 = np.minimum(boxes[i, 3], boxes[order[1:], 3])
+        inter = np.clip(xx2-xx1, 0, None) * np.clip(yy2-yy1, 0, None)
+        iou = inter / (areas[i]+areas[order[1:]]-inter+1e-9)
+        order = order[1:][iou<=iou_threshold]
+    return np.array(keep, dtype=int)
+
+def detector_input(arrays):
+    # 정사각형 입력이므로 letterbox = 단순 리사이즈
+    batch = np.stack([cv2.resize(array, (DETECTOR_IMGSZ, DETECTOR_IMGSZ)) for array in arrays])
+    return np.ascontiguousarray(batch.transpose(0, 3, 1, 2), dtype=np.float32) / 255.0
+
+class OnnxDetector:
+    # ultralytics YOLO(image)와 같은 방식으로 호출
+    def __init__(self, path=YOLO_ONNX_PATH, threads=ONNX_THREADS, conf=DETECTOR_CONF, iou=DETECTOR_IOU):
+        self.session = create_session(path, threads)
+        self.input_name = self.session.get_inputs()[0].name
+        self.conf = conf
+        self.iou = iou
+        names = self.session.get_modelmeta().custom_metadata_map.get('names')
+        self.names = ast.literal_eval(names) if names else {}
+
+    def __call__(self, images, verbose=False):
+        if not isinstance(images, (list, tuple)):
+            images = [images]
+        arrays = [np.asarray(image.convert('RGB') if isinstance(image, Image.Image) else image) for image in images]
+        outputs = self.session.run(None, {self.input_name: detector_input(arrays)})[0] # (N, 4+클래스 수, 앵커 수)
+
+        return [self._postprocess(output, array) for output, array in zip(outputs, arrays)]
+
+    def _postprocess(self, output, array):
+        predictions = output.T
+        class_scores = predictions[:, 4:]
+        classes = class_scores.argmax(axis=1)
+        scores = class_scores[np.arange(len(classes)), classes]
+        mask = scores>self.conf
+        predictions, classes, scores = predictions[mask], classes[mask], scores[mask]
+
+        # cx, cy, w, h -> x1, y1, x2, y2 (원본 크기 기준)
+        scale = np.array([array.shape[1], array.shape[0]] * 2, dtype=np.float32) / DETECTOR_IMGSZ
+        cx, cy, w, h = predictions[:, 0], predictions[:, 1], predictions[:, 2], predictions[:, 3]
+        boxes = np.stack([cx-w/2, cy-h/2, cx+w/2, cy+h/2], axis=1) * scale
+
+        # 클래스별 NMS (클래스마다 좌표를 띄워서 한 번에 처리)
+        keep = nms(boxes + classes[:, None]*4096.0, scores, self.iou) if len(scores)>0 else np.zeros(0, dtype=int)
+        return OnnxResult(array, OnnxBoxes(boxes[keep].astype(np.float32), scores[keep].astype(np.float32), classes[keep]), self.names)
+
+def load_onnx_model(diagnosis_type, threads=ONNX_THREADS, quantized=False):
+    start = time.perf_counter()
+    if diagnosis_type==0:
+        model = OnnxClassifier(CLASSIFIER_INT8_PATH if quantized else CLASSIFIER_ONNX_PATH, threads)
+    else:
+        model = OnnxDetector(YOLO_INT8_PATH if quantized else YOLO_ONNX_PATH, threads)
+    name = 'classifier' if diagnosis_type==0 else 'detector'
+    im.STARTUP_TIMES[f'load:{name}-{"onnx-int8" if quantized else "onnx"}'] = round(time.perf_counter()-start, 3)
+    return model
+
+
+## 패리티 검사
+def box_iou(a, b):
+    inter = max(0.0, min(a[2], b[2])-max(a[0], b[0])) * max(0.0, min(a[3], b[3])-max(a[1], b[1]))
+    union = (a[2]-a[0])*(a[3]-a[1]) + (b[2]-b[0])*(b[3]-b[1]) - inter
+    return inter/union if union>0 else 1.0
+
+def check_parity(image_paths, diagnosis_type, prob_tolerance=PROB_TOLERANCE, iou_tolerance=BOX_IOU_TOLERANCE):
+    native = im.load_model(diagnosis_type, backend='native')
+    onnx = im.load_model(diagnosis_type, backend='onnx')
+
+    failures = []
+    max_prob_diff = 0.0
+    for path in image_paths:
+        with Image.open(path) as image:
+            image = image.convert('RGB')
+        expected = im.predict_batch([image], native, diagnosis_type)[0]
+        actual = im.predict_batch([image], onnx, diagnosis_type)[0]
+
+        prob_diff = abs(expected['prob']-actual['prob'])
+        max_prob_diff = max(max_prob_diff, prob_diff)
+        reasons = []
+        if prob_diff>prob_tolerance:
+            reasons.append(f'prob {expected["prob"]} vs {actual["prob"]}')
+        if expected['label']!=actual['label']:
+            reasons.append(f'label {expected["label"]} vs {actual["label"]}')
+        if len(expected['boxes'])!=len(actual['boxes']):
+            reasons.append(f'boxes {len(expected["boxes"])} vs {len(actual["boxes"])}')
+        else:
+            for e, a in zip(sorted(expected['boxes'], key=lambda b: -b['score']), sorted(actual['boxes'], key=lambda b: -b['score'])):
+                if e['class']!=a['class'] or box_iou(e['xyxy'], a['xyxy'])<iou_tolerance:
+                    reasons.append(f'box {e} vs {a}')
+        if reasons:
+            failures.append({'path': path, 'reasons': reasons})
+
+    return {'images': len(image_paths), 'max_prob_diff': round(max_prob_diff, 4), 'failures': failures}
+
+def main(argv=None):
+    from batch_predict import collect_image_paths
+
+    parser = argparse.ArgumentParser(description='ONNX 모델 내보내기 / 패리티 검사')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('export', help='두 모델을 ONNX로 내보내기')
+    parity = subparsers.add_parser('parity', help='기존 모델과 ONNX 출력 비교')
+    parity.add_argument('inputs', nargs='+', help='샘플 이미지 파일 또는 디렉터리')
+    parity.add_argument('--type', type=int, choices=[0, 1], required=True)
+    args = parser.parse_args(argv)
+
+    if args.command=='export':
+        print(export_classifier())
+        print(export_detector())
+    else:
+        report = check_parity(collect_image_paths(args.inputs), args.type)
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+        sys.exit(1 if report['failures'] else 0)
+
+if __name__=='__main__':
+    main()
@@ -0,0 +1,113 @@
+import os, queue, sys, threading
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+
+import image_model as im
+
+SLOT_SHAPES = {0: (180, 180), 1: (512, 512, 3)} # preprocess_for_model 출력 크기
+
+_shm = None # 워커 프로세스별 공유 메모리 핸들
+
+
+## 워커 (별도 프로세스)
+def _init_worker(shm_name):
+    global _shm
+    _shm = shared_memory.SharedMemory(name=shm_name) # 해제(unlink)는 생성한 메인 프로세스에서만
+
+def _preprocess_into(index, path, slot, diagnosis_type):
+    # 디코드 + 전처리 결과를 공유 메모리 슬롯에 직접 기록 (이미지 자체는 pickle하지 않음)
+    shape = SLOT_SHAPES[diagnosis_type]
+    try:
+        array = im.preprocess_for_model(im.decode_image(path), diagnosis_type)
+        target = np.ndarray(shape, dtype=np.uint8, buffer=_shm.buf, offset=slot*int(np.prod(shape)))
+        target[...] = array
+        return index, path, slot, None
+    except Exception as e:
+        return index, path, slot, str(e)
+
+
+## 파이프라인 (생산자: 워커 풀 / 소비자: 추론)
+class PreprocessPipeline:
+    def __init__(self, diagnosis_type, workers=None, queue_size=64, batch_size=16, ordered=True):
+        self.diagnosis_type = diagnosis_type
+        self.workers = workers or os.cpu_count()
+        self.queue_size = max(queue_size, batch_size) # 슬롯 수 = 동시에 처리 중인 최대 이미지 수 (백프레셔)
+        self.batch_size = batch_size
+        self.ordered = ordered
+
+    def batches(self, paths):
+        # (경로 목록, 전처리 배열 목록) 배치를 순서대로 반환
+        shape = SLOT_SHAPES[self.diagnosis_type]
+        slot_bytes = int(np.prod(shape))
+        shm = shared_memory.SharedMemory(create=True, size=slot_bytes*self.queue_size)
+        free_slots = queue.Queue()
+        for slot in range(self.queue_size):
+            free_slots.put(slot)
+        completed = queue.Queue()
+        stop = threading.Event()
+        submitted = [0, False] # [제출 수, 제출 완료 여부]
+
+        try:
+            with ProcessPoolExecutor(self.workers, initializer=_init_worker, initargs=(shm.name,)) as pool:
+                def produce():
+                    for index, path in enumerate(paths):
+                        slot = free_slots.get() # 빈 슬롯이 생길 때까지 대기
+                        if stop.is_set():
+                            break
+                        try:
+                            future = pool.submit(_preprocess_into, index, path, slot, self.diagnosis_type)
+                        except RuntimeError: # 풀 종료됨
+                            break
+                        future.add_done_callback(lambda f: completed.put(f.result()))
+                        submitted[0] += 1
+                    submitted[1] = True
+                    completed.put(None) # 제출 완료 알림
+
+                producer = threading.Thread(target=produce, daemon=True)
+                producer.start()
+
+                yield from self._consume(shm, shape, slot_bytes, free_slots, completed, submitted)
+        finally:
+            stop.set()
+            free_slots.put(0) # 대기 중인 생산자 깨우기
+            shm.close()
+            shm.unlink()
+
+    def _consume(self, shm, shape, slot_bytes, free_slots, completed, submitted):
+        pending = {} # 순서 보장용 재정렬 버퍼
+        next_index = 0
+        received = 0
+        batch_paths, batch_arrays = [], []
+
+        while not (submitted[1] and received==submitted[0]):
+            item = completed.get()
+            if item is None:
+                continue
+            received += 1
+
+            if self.ordered:
+                pending[item[0]] = item
+                ready = []
+                while next_index in pending:
+                    ready.append(pending.pop(next_index))
+                    next_index += 1
+            else:
+                ready = [item]
+
+            for _, path, slot, error in ready:
+                if error is None:
+                    array = np.ndarray(shape, dtype=np.uint8, buffer=shm.buf, offset=slot*slot_bytes)
+                    batch_paths.append(path)
+                    batch_arrays.append(array.copy())
+                else:
+                    print(f'Error preprocessing {path}: {error}', file=sys.stderr)
+                free_slots.put(slot)
+
+                if len(batch_arrays)==self.batch_size:
+                    yield batch_paths, batch_arrays
+                    batch_paths, batch_arrays = [], []
+
+        if batch_arrays:
+            yield batch_paths, batch_arrays
@@ -0,0 +1,148 @@
+import argparse, json, multiprocessing, os, time
+
+import numpy as np
+from PIL import Image
+
+import image_model as im
+import onnx_backend as ob
+from batch_predict import collect_image_paths
+
+
+## 보정 데이터
+class ImageCalibrationReader:
+    # onnxruntime.quantization.CalibrationDataReader 인터페이스
+    def __init__(self, image_paths, diagnosis_type, input_name, batch_size=8):
+        self.image_paths = image_paths
+        self.diagnosis_type = diagnosis_type
+        self.input_name = input_name
+        self.batch_size = batch_size
+        self._batches = None
+
+    def _iter_batches(self):
+        for i in range(0, len(self.image_paths), self.batch_size):
+            arrays = []
+            for path in self.image_paths[i:i+self.batch_size]:
+                with Image.open(path) as image:
+                    arrays.append(im.preprocess_for_model(image.convert('RGB'), self.diagnosis_type))
+            if self.diagnosis_type==0:
+                batch = np.repeat(np.stack(arrays)[..., None], 3, axis=-1).astype(np.float32)
+            else:
+                batch = ob.detector_input(arrays)
+            yield {self.input_name: batch}
+
+    def get_next(self):
+        if self._batches is None:
+            self._batches = self._iter_batches()
+        return next(self._batches, None)
+
+    def rewind(self):
+        self._batches = None
+
+
+## 양자화
+def quantize(diagnosis_type, calibration_paths=None, mode='static'):
+    quantization = im.lazy_import('onnxruntime.quantization')
+
+    float_path = ob.CLASSIFIER_ONNX_PATH if diagnosis_type==0 else ob.YOLO_ONNX_PATH
+    int8_path = ob.CLASSIFIER_INT8_PATH if diagnosis_type==0 else ob.YOLO_INT8_PATH
+    if mode=='dynamic' or not calibration_paths: # 가중치만 INT8
+        quantization.quantize_dynamic(float_path, int8_path, weight_type=quantization.QuantType.QInt8)
+    else: # 활성값 범위를 보정 이미지로 측정
+        input_name = ob.create_session(float_path).get_inputs()[0].name
+        reader = ImageCalibrationReader(calibration_paths, diagnosis_type, input_name)
+        quantization.quantize_static(float_path, int8_path, reader,
+            quant_format=quantization.QuantFormat.QDQ, per_channel=True,
+            activation_type=quantization.QuantType.QUInt8, weight_type=quantization.QuantType.QInt8)
+    return int8_path
+
+
+## 비교 리포트
+def _rss_mb():
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+def _model_path(diagnosis_type, backend):
+    if backend=='native':
+        return im.classifier_path() if diagnosis_type==0 else im.YOLO_PATH
+    if backend=='onnx':
+        return ob.CLASSIFIER_ONNX_PATH if diagnosis_type==0 else ob.YOLO_ONNX_PATH
+    return ob.CLASSIFIER_INT8_PATH if diagnosis_type==0 else ob.YOLO_INT8_PATH
+
+def _evaluate(args):
+    # 모델별 메모리를 분리해서 재도록 별도 프로세스에서 실행
+    diagnosis_type, backend, samples = args
+    rss_before = _rss_mb()
+    model = im.load_model(diagnosis_type, backend=backend)
+    # 첫 추론에서 생기는 import/세션 메모리까지 포함하도록 워밍업 후 측정
+    im.predict_batch([Image.new('RGB', (512, 512))], model, diagnosis_type)
+    rss_loaded = _rss_mb()
+
+    outputs, latencies = [], []
+    for path, _ in samples:
+        with Image.open(path) as image:
+            image = image.convert('RGB')
+        start = time.perf_counter()
+        outputs.append(im.predict_batch([image], model, diagnosis_type)[0])
+        latencies.append(time.perf_counter()-start)
+    rss_after = _rss_mb()
+
+    return {
+        'backend': backend,
+        'size_mb': round(os.path.getsize(_model_path(diagnosis_type, backend)) / 2**20, 2),
+        'rss_mb': round(rss_loaded-rss_before, 1),
+        'rss_after_eval_mb': round(rss_after-rss_before, 1),
+        'latency_ms_p50': round(float(np.percentile(latencies, 50))*1000, 2) if latencies else None,
+        'latency_ms_p95': round(float(np.percentile(latencies, 95))*1000, 2) if latencies else None,
+        'outputs': outputs,
+    }
+
+def load_holdout(holdout_dir):
+    # holdout/0/*.jpg (정상), holdout/1/*.jpg (이상)
+    samples = []
+    for name in ('0', '1'):
+        for path in collect_image_paths([os.path.join(holdout_dir, name)]):
+            samples.append((path, int(name)))
+    return samples
+
+def compare(diagnosis_type, holdout_dir, backends=('native', 'onnx', 'onnx-int8')):
+    samples = load_holdout(holdout_dir)
+    context = multiprocessing.get_context('spawn')
+    with context.Pool(1, maxtasksperchild=1) as pool:
+        reports = pool.map(_evaluate, [(diagnosis_type, backend, samples) for backend in backends], chunksize=1)
+
+    reference = reports[0]['outputs']
+    for report in reports:
+        outputs = report.pop('outputs')
+        predicted = [int(output['label'] in im.POSITIVE_LABELS) for output in outputs]
+        report['accuracy'] = round(float(np.mean([p==label for p, (_, label) in zip(predicted, samples)])), 4) if samples else None
+        report['agreement'] = round(float(np.mean([a['label']==b['label'] for a, b in zip(outputs, reference)])), 4) if samples else None
+        report['max_prob_diff'] = round(max([abs(a['prob']-b['prob']) for a, b in zip(outputs, reference)], default=0.0), 2)
+
+    base = reports[0]
+    for report in reports[1:]: # 기준(첫 번째 백엔드) 대비 차이
+        report['delta'] = {key: round(report[key]-base[key], 4) for key in ('size_mb', 'rss_mb', 'rss_after_eval_mb', 'latency_ms_p50', 'accuracy')
+            if report[key] is not None and base[key] is not None}
+    return {'images': len(samples), 'reports': reports}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='INT8 양자화 모델 생성 / 비교')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    build = subparsers.add_parser('build', help='ONNX 모델을 INT8로 양자화')
+    build.add_argument('--type', type=int, choices=[0, 1], required=True)
+    build.add_argument('--mode', choices=['static', 'dynamic'], default='static')
+    build.add_argument('--calibration', nargs='*', default=[], help='보정 이미지 파일 또는 디렉터리')
+    report = subparsers.add_parser('report', help='크기, 메모리, 지연 시간, 정확도 비교')
+    report.add_argument('holdout', help='0/, 1/ 하위 폴더로 라벨링된 평가 이미지 디렉터리')
+    report.add_argument('--type', type=int, choices=[0, 1], required=True)
+    args = parser.parse_args(argv)
+
+    if args.command=='build':
+        print(quantize(args.type, collect_image_paths(args.calibration), args.mode))
+    else:
+        print(json.dumps(compare(args.type, args.holdout), ensure_ascii=False, indent=2))
+
+if __name__=='__main__':
+    main()
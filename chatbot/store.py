@@ -0,0 +1,206 @@
+import io, os, sqlite3, threading, time
+
+import streamlit as st
+from PIL import Image
+
+STORE_PATH = os.getenv('ESC_STORE_PATH', 'data/esc.sqlite3') # 빈 문자열이면 사용 안 함
+STORE_FLUSH_SIZE = 64 # 모아서 한 트랜잭션으로 기록할 최대 건수
+STORE_FLUSH_SECONDS = 1.0
+STORE_RETENTION_DAYS = int(os.getenv('ESC_STORE_RETENTION_DAYS', 90))
+STORE_COMPACT_SECONDS = 24 * 60 * 60 # 보존 기간 정리 주기
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS images (
+    image_hash TEXT PRIMARY KEY,
+    created_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS predictions (
+    id INTEGER PRIMARY KEY,
+    image_hash TEXT NOT NULL REFERENCES images(image_hash),
+    diagnosis_type INTEGER NOT NULL,
+    model_version TEXT NOT NULL,
+    prob REAL NOT NULL,
+    label TEXT NOT NULL,
+    has_overlay INTEGER NOT NULL,
+    overlay BLOB,
+    created_at REAL NOT NULL,
+    UNIQUE (image_hash, diagnosis_type, model_version)
+);
+CREATE INDEX IF NOT EXISTS predictions_created_at ON predictions(created_at);
+CREATE TABLE IF NOT EXISTS detections (
+    prediction_id INTEGER NOT NULL REFERENCES predictions(id) ON DELETE CASCADE,
+    x1 REAL, y1 REAL, x2 REAL, y2 REAL,
+    score REAL NOT NULL,
+    class INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS detections_prediction ON detections(prediction_id);
+CREATE TABLE IF NOT EXISTS records (
+    form_fingerprint TEXT PRIMARY KEY,
+    image_hash TEXT,
+    diagnosis_type INTEGER NOT NULL,
+    record TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS records_image_hash ON records(image_hash);
+CREATE INDEX IF NOT EXISTS records_created_at ON records(created_at);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value REAL NOT NULL
+);
+'''
+
+
+## 예측 / 기록지 저장소 (SQLite)
+class Store:
+    def __init__(self, path=STORE_PATH, flush_size=STORE_FLUSH_SIZE, flush_seconds=STORE_FLUSH_SECONDS,
+                 retention_days=STORE_RETENTION_DAYS):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self.flush_size = flush_size
+        self.flush_seconds = flush_seconds
+        self.retention_days = retention_days
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL') # 다른 프로세스(레플리카)와 동시 읽기
+        self._conn.execute('PRAGMA foreign_keys=ON')
+        self._conn.executescript(SCHEMA)
+        self._lock = threading.Lock()
+        self._pending_predictions = {} # 아직 기록하지 않은 쓰기 (조회 시 먼저 확인)
+        self._pending_records = {}
+        self._wakeup = threading.Event()
+        self._last_compact = self._load_last_compact()
+        threading.Thread(target=self._flush_loop, name='store-flush', daemon=True).start()
+
+    # 예측
+    def get_prediction(self, image_hash, diagnosis_type, model_version):
+        key = (image_hash, diagnosis_type, model_version)
+        with self._lock:
+            if key in self._pending_predictions:
+                return self._pending_predictions[key]
+            row = self._conn.execute(
+                'SELECT id, prob, label, has_overlay, overlay FROM predictions '
+                'WHERE image_hash=? AND diagnosis_type=? AND model_version=?', key).fetchone()
+            if row is None:
+                return None
+            boxes = self._conn.execute('SELECT x1, y1, x2, y2, score, class FROM detections WHERE prediction_id=?', (row[0],)).fetchall()
+
+        overlay = None
+        if row[4] is not None:
+            overlay = Image.open(io.BytesIO(row[4]))
+            overlay.load()
+        return {
+            'prob': row[1], 'label': row[2], 'has_overlay': bool(row[3]), 'overlay': overlay,
+            'boxes': [{'xyxy': [x1, y1, x2, y2], 'score': score, 'class': cls} for x1, y1, x2, y2, score, cls in boxes],
+        }
+
+    def put_prediction(self, image_hash, diagnosis_type, model_version, prob, label, boxes=(), overlay=None, has_overlay=None):
+        prediction = {'prob': float(prob), 'label': label, 'has_overlay': overlay is not None if has_overlay is None else has_overlay,
+            'overlay': overlay, 'boxes': list(boxes)}
+        with self._lock:
+            self._pending_predictions[(image_hash, diagnosis_type, model_version)] = prediction
+        self._maybe_flush()
+
+    # 기록지
+    def get_record(self, form_fingerprint):
+        with self._lock:
+            if form_fingerprint in self._pending_records:
+                return self._pending_records[form_fingerprint][2]
+            row = self._conn.execute('SELECT record FROM records WHERE form_fingerprint=?', (form_fingerprint,)).fetchone()
+        return row[0] if row is not None else None
+
+    def put_record(self, form_fingerprint, diagnosis_type, record, image_hash=None):
+        with self._lock:
+            self._pending_records[form_fingerprint] = (image_hash, diagnosis_type, record)
+        self._maybe_flush()
+
+    def _load_last_compact(self):
+        # 마지막 정리 시각은 DB에 저장 (재시작마다 시작 직후 정리/VACUUM이 돌지 않도록). 새 DB는 지금부터 주기 계산
+        row = self._conn.execute("SELECT value FROM meta WHERE key='last_compact'").fetchone()
+        if row is not None:
+            return row[0]
+        now = time.time()
+        with self._conn:
+            self._conn.execute("INSERT OR IGNORE INTO meta VALUES ('last_compact', ?)", (now,))
+        return now
+
+    # 쓰기 배치
+    def _maybe_flush(self):
+        if len(self._pending_predictions)+len(self._pending_records)>=self.flush_size:
+            self._wakeup.set()
+
+    def _flush_loop(self):
+        while True:
+            self._wakeup.wait(self.flush_seconds)
+            self._wakeup.clear()
+            try:
+                self.flush()
+                if time.time()-self._last_compact>STORE_COMPACT_SECONDS:
+                    self.compact()
+            except sqlite3.Error as e:
+                print(f'Error in Store flush: {e}')
+
+    def flush(self):
+        with self._lock:
+            predictions, self._pending_predictions = self._pending_predictions, {}
+            records, self._pending_records = self._pending_records, {}
+            if not predictions and not records:
+                return
+            try:
+                self._write(predictions, records)
+            except sqlite3.Error:
+                # 실패한 쓰기는 다시 대기열에 넣어 다음 flush에서 재시도 (그 사이 들어온 더 새 값이 우선)
+                self._pending_predictions = {**predictions, **self._pending_predictions}
+                self._pending_records = {**records, **self._pending_records}
+                raise
+
+    def _write(self, predictions, records):
+        now = time.time()
+        with self._conn: # 한 트랜잭션
+            for (image_hash, diagnosis_type, model_version), prediction in predictions.items():
+                self._conn.execute('INSERT OR IGNORE INTO images (image_hash, created_at) VALUES (?, ?)', (image_hash, now))
+                self._conn.execute('DELETE FROM predictions WHERE image_hash=? AND diagnosis_type=? AND model_version=?',
+                    (image_hash, diagnosis_type, model_version))
+                cursor = self._conn.execute(
+                    'INSERT INTO predictions (image_hash, diagnosis_type, model_version, prob, label, has_overlay, overlay, created_at) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                    (image_hash, diagnosis_type, model_version, prediction['prob'], prediction['label'],
+                     int(prediction['has_overlay']), _encode_png(prediction['overlay']), now))
+                self._conn.executemany('INSERT INTO detections VALUES (?, ?, ?, ?, ?, ?, ?)',
+                    [(cursor.lastrowid, *box['xyxy'], box['score'], box['class']) for box in prediction['boxes']])
+            for form_fingerprint, (image_hash, diagnosis_type, record) in records.items():
+                self._conn.execute('INSERT OR REPLACE INTO records VALUES (?, ?, ?, ?, ?)',
+                    (form_fingerprint, image_hash, diagnosis_type, record, now))
+
+    # 보존 기간 정리
+    def compact(self, retention_days=None):
+        retention_days = self.retention_days if retention_days is None else retention_days
+        cutoff = time.time() - retention_days*24*60*60
+        now = time.time()
+        with self._lock:
+            with self._conn:
+                deleted = self._conn.execute('DELETE FROM predictions WHERE created_at<?', (cutoff,)).rowcount
+                deleted += self._conn.execute('DELETE FROM records WHERE created_at<?', (cutoff,)).rowcount
+                self._conn.execute('DELETE FROM images WHERE image_hash NOT IN (SELECT image_hash FROM predictions)')
+                self._conn.execute("INSERT OR REPLACE INTO meta VALUES ('last_compact', ?)", (now,))
+            self._last_compact = now
+        if deleted: # VACUUM은 별도 연결에서 (조회가 락을 기다리지 않도록), 지운 것이 있을 때만
+            conn = sqlite3.connect(self.path)
+            try:
+                conn.execute('VACUUM')
+            finally:
+                conn.close()
+
+    def close(self):
+        self.flush()
+        self._conn.close()
+
+def _encode_png(image):
+    if image is None:
+        return None
+    buffer = io.BytesIO()
+    image.save(buffer, format='PNG')
+    return buffer.getvalue()
+
+@st.cache_resource
+def load_store():
+    return Store(STORE_PATH) if STORE_PATH else None
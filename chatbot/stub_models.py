@@ -0,0 +1,62 @@
+import time
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from onnx_backend import OnnxBoxes, OnnxResult
+
+STUB_NAMES = {0: 'normal', 1: 'tumor'}
+
+
+## 가중치 없이 돌아가는 대체 모델 (벤치마크/부하 테스트용)
+class StubClassifier:
+    # Keras model.predict와 같은 방식으로 호출. 입력 밝기로 결정적인 확률 반환
+    def __init__(self, latency=0.0):
+        self.latency = latency # 이미지당 추가 지연 (초)
+
+    def predict(self, inputs, batch_size=None, verbose=0):
+        batch = np.asarray(inputs, dtype=np.float32)
+        time.sleep(self.latency*len(batch))
+        positive = batch.reshape(len(batch), -1).mean(axis=1) / 255.0
+        return np.stack([1-positive, positive], axis=1)
+
+class StubDetector:
+    # ultralytics YOLO(image)와 같은 방식으로 호출. 가장 밝은 영역에 박스 1개
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.names = STUB_NAMES
+
+    def __call__(self, images, verbose=False):
+        if not isinstance(images, (list, tuple)):
+            images = [images]
+        time.sleep(self.latency*len(images))
+        results = []
+        for image in images:
+            array = np.asarray(image.convert('RGB') if isinstance(image, Image.Image) else image)
+            gray = cv2.cvtColor(array, cv2.COLOR_RGB2GRAY)
+            _, max_value, _, (x, y) = cv2.minMaxLoc(cv2.GaussianBlur(gray, (31, 31), 0))
+            score = np.float32(max_value/255.0)
+            box = np.array([[x-32, y-32, x+32, y+32]], dtype=np.float32)
+            cls = np.array([1 if score>0.5 else 0])
+            results.append(OnnxResult(array, OnnxBoxes(box, np.array([score]), cls), self.names))
+        return results
+
+def load_stub_model(diagnosis_type, latency=0.0):
+    return StubClassifier(latency) if diagnosis_type==0 else StubDetector(latency)
+
+
+## 합성 이미지
+def synthetic_image(diagnosis_type, size, seed=0):
+    # 0: 초음파 (스페클 노이즈 + 저에코 결절), 1: MRI (두개골 + 밝은 병변)
+    rng = np.random.default_rng(seed)
+    width, height = size
+    if diagnosis_type==0:
+        image = rng.gamma(2.0, 30.0, (height, width)).clip(0, 255).astype(np.uint8)
+        cv2.ellipse(image, (width//2, height//2), (width//8, height//10), 0, 0, 360, 40, -1)
+    else:
+        image = np.zeros((height, width), dtype=np.uint8)
+        cv2.ellipse(image, (width//2, height//2), (width*2//5, height*9//20), 0, 0, 360, 110, -1)
+        cv2.circle(image, (width*3//5, height*2//5), max(4, min(width, height)//12), 220, -1)
+        image = cv2.add(image, rng.normal(0, 8, (height, width)).clip(0, 255).astype(np.uint8))
+    return Image.fromarray(cv2.cvtColor(image, cv2.COLOR_GRAY2RGB))
@@ -0,0 +1,147 @@
+import io, os
+
+import numpy as np
+from PIL import Image
+
+import image_model as im
+import metrics
+
+VOLUME_BATCH_SIZE = int(os.getenv('ESC_VOLUME_BATCH_SIZE', 8))
+VOLUME_EARLY_EXIT = float(os.getenv('ESC_VOLUME_EARLY_EXIT', 0.8)) # 이 점수 이상 뇌종양 슬라이스가 나오면 중단 (0: 사용 안 함)
+
+
+## 슬라이스 읽기 (필요할 때 한 장씩)
+class VolumeSource:
+    def __init__(self, slice_loaders):
+        self.slice_loaders = slice_loaders # 슬라이스 순서대로 2차원 배열을 반환하는 함수 목록
+
+    def __len__(self):
+        return len(self.slice_loaders)
+
+    def iter_batches(self, batch_size=VOLUME_BATCH_SIZE):
+        for start in range(0, len(self), batch_size):
+            indices = list(range(start, min(start+batch_size, len(self))))
+            yield indices, np.stack([to_uint8(self.slice_loaders[i]()) for i in indices])
+
+def to_uint8(pixels, window=None):
+    # DICOM 12/16비트 -> 8비트 (윈도우 정보가 없으면 슬라이스 내 0.5~99.5 백분위 기준)
+    pixels = np.asarray(pixels)
+    if pixels.dtype==np.uint8:
+        return pixels
+    pixels = pixels.astype(np.float32)
+    if window is not None:
+        low, high = window
+    else:
+        low, high = np.percentile(pixels, [0.5, 99.5])
+    scaled = (pixels-low) / max(high-low, 1e-6) * 255.0
+    return np.clip(scaled, 0, 255).astype(np.uint8)
+
+def _dicom_loader(source):
+    pydicom = im.lazy_import('pydicom')
+
+    def load():
+        dataset = pydicom.dcmread(source() if callable(source) else source)
+        pixels = dataset.pixel_array.astype(np.float32)
+        pixels = pixels*float(getattr(dataset, 'RescaleSlope', 1)) + float(getattr(dataset, 'RescaleIntercept', 0))
+        center, width = getattr(dataset, 'WindowCenter', None), getattr(dataset, 'WindowWidth', None)
+        if center is not None and width is not None:
+            center = float(center[0] if isinstance(center, pydicom.multival.MultiValue) else center)
+            width = float(width[0] if isinstance(width, pydicom.multival.MultiValue) else width)
+            return to_uint8(pixels, (center-width/2, center+width/2))
+        return to_uint8(pixels)
+    return load
+
+def _dicom_order(dataset):
+    # 위치 정보 -> 인스턴스 번호 순으로 정렬
+    position = getattr(dataset, 'ImagePositionPatient', None)
+    return (float(position[2]) if position is not None else 0.0, int(getattr(dataset, 'InstanceNumber', 0) or 0))
+
+def open_dicom_series(sources):
+    # sources: 파일 경로 또는 바이트 목록. 정렬용 헤더만 먼저 읽고 픽셀은 나중에
+    pydicom = im.lazy_import('pydicom')
+
+    entries = []
+    for source in sources:
+        opener = (lambda data=source: io.BytesIO(data)) if isinstance(source, bytes) else source
+        header = pydicom.dcmread(opener() if callable(opener) else opener, stop_before_pixels=True)
+        entries.append((_dicom_order(header), opener))
+    entries.sort(key=lambda entry: entry[0])
+    return VolumeSource([_dicom_loader(opener) for _, opener in entries])
+
+def open_array_volume(source):
+    # (슬라이스, H, W) 배열 .npy. 경로면 메모리 맵으로 열어 슬라이스 단위로 읽음
+    volume = np.load(source, mmap_mode='r') if isinstance(source, str) else np.load(io.BytesIO(source))
+    if volume.ndim!=3:
+        raise ValueError(f'(슬라이스, H, W) 배열이 필요합니다: {volume.shape}')
+    return VolumeSource([lambda i=i: volume[i] for i in range(len(volume))])
+
+def open_volume(paths):
+    # 디렉터리(DICOM 시리즈) / .npy 파일 / DICOM 파일 목록
+    if isinstance(paths, str):
+        paths = [paths]
+    if len(paths)==1 and paths[0].lower().endswith('.npy'):
+        return open_array_volume(paths[0])
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files += [os.path.join(path, name) for name in sorted(os.listdir(path)) if not name.startswith('.')]
+        else:
+            files.append(path)
+    return open_dicom_series(files)
+
+def open_uploaded_volume(uploaded_files):
+    if len(uploaded_files)==1 and uploaded_files[0].name.lower().endswith('.npy'):
+        return open_array_volume(uploaded_files[0].getvalue())
+    return open_dicom_series([uploaded_file.getvalue() for uploaded_file in uploaded_files])
+
+
+## 슬라이스 배치 검출
+def detect_volume(volume, model, batch_size=VOLUME_BATCH_SIZE, early_exit=VOLUME_EARLY_EXIT):
+    im.require_local_model(model, 'MRI 시리즈 분석')
+    slices = []
+    best = None # (점수, 슬라이스 번호, Detections)
+    stopped_early = False
+    for indices, batch in volume.iter_batches(batch_size):
+        with metrics.timed('preprocess_volume'):
+            images = [Image.fromarray(array) for array in im.preprocess_slices_for_yolo(batch)]
+        with metrics.timed('forward_yolo'):
+            results = model(images, verbose=False)
+
+        for index, result, image in zip(indices, results, images):
+            detections = im.Detections.from_result(result, image)
+            prob, label = detections.prob_label
+            slices.append({'index': index, 'prob': float(prob), 'label': label, 'boxes': detections.to_boxes()})
+            tumor_score = prob if label=='뇌종양' else 0.0
+            if best is None or tumor_score>best[0]:
+                best = (tumor_score, index, detections)
+
+        if early_exit and best is not None and best[0]>=early_exit*100: # 확신할 만한 슬라이스가 나오면 중단
+            stopped_early = True
+            break
+
+    return study_result(slices, best, len(volume), stopped_early)
+
+def study_result(slices, best, total_slices, stopped_early):
+    positives = [s for s in slices if s['label']=='뇌종양']
+    if positives:
+        prob, label = max(s['prob'] for s in positives), '뇌종양'
+    else: # 모든 슬라이스 정상: 가장 낮은 정상 신뢰도 기준
+        prob, label = (min(s['prob'] for s in slices) if slices else 0.0), '정상'
+    return {
+        'prob': round(prob, 2),
+        'label': label,
+        'positive_slices': [s['index'] for s in positives],
+        'best_slice': best[1] if best is not None else None,
+        'best_detections': best[2] if best is not None else None,
+        'slices_processed': len(slices),
+        'total_slices': total_slices,
+        'stopped_early': stopped_early,
+        'slices': slices,
+    }
+
+def study_summary(result):
+    # generate_medical_record의 진단 결과 문구
+    summary = f"{result['label']} (전체 {result['total_slices']}장 중 {result['slices_processed']}장 분석"
+    if result['positive_slices']:
+        summary += f", 검출 슬라이스 {', '.join(str(i+1) for i in result['positive_slices'][:10])}"
+    return summary + ')'